@@ -1,33 +1,140 @@
 import os
-from typing import List, Optional
+from contextlib import contextmanager
+from typing import Iterator, List, Optional
 
+import orjson
+import zstandard
 from sqlalchemy import (
     create_engine,
     Column,
     Integer,
     String,
-    JSON,
+    LargeBinary,
+    Text,
+    TypeDecorator,
     ForeignKey,
+    Index,
+    bindparam,
+    event,
+    func,
+    insert,
     inspect,
+    literal,
+    select,
     text,
+    update,
 )
-from sqlalchemy.orm import declarative_base, sessionmaker, relationship
+from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+from sqlalchemy.orm import Session, declarative_base, sessionmaker, relationship
 
 DB_PATH = os.getenv("SCRAPER_DB", "scraper.db")
-engine = create_engine(f"sqlite:///{DB_PATH}", echo=False, future=True)
+engine = create_engine(
+    f"sqlite:///{DB_PATH}",
+    echo=False,
+    future=True,
+    # API threads and Celery workers share the same file; wait for the write
+    # lock instead of failing immediately with ``database is locked``.
+    connect_args={"check_same_thread": False, "timeout": 30},
+    # Keep connections open across calls. API handlers run in a thread pool,
+    # so allow more concurrent checkouts than the default 5 + 10.
+    pool_size=20,
+    max_overflow=10,
+    # Chunk multi-row INSERTs so large result batches become few statements.
+    insertmanyvalues_page_size=1000,
+    # orjson is several times faster than the stdlib for the JSON columns.
+    json_serializer=lambda obj: orjson.dumps(obj).decode(),
+    json_deserializer=orjson.loads,
+)
+
+
+@event.listens_for(engine, "connect")
+def _set_sqlite_pragmas(dbapi_conn, _record) -> None:
+    """Tune every new SQLite connection for concurrent, write-heavy use.
+
+    WAL lets readers (status polls) proceed while workers commit results and
+    ``synchronous=NORMAL`` avoids an fsync per transaction, which is safe in
+    WAL mode.
+    """
+    cursor = dbapi_conn.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.close()
+
+
 SessionLocal = sessionmaker(bind=engine, autoflush=False, autocommit=False)
 Base = declarative_base()
 
 
+class LazyJSON(TypeDecorator):
+    """JSON stored as text and handed back undecoded.
+
+    Large blobs such as a job's URL list are mostly consumed inside SQLite
+    (``json_each``), so decoding them on every ORM load is wasted work. Callers
+    that need the Python value decode it explicitly.
+    """
+
+    impl = Text
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return orjson.dumps(value).decode()
+
+    def process_result_value(self, value, dialect):
+        return value
+
+
+class ZstdJSON(TypeDecorator):
+    """JSON serialised with orjson and compressed with zstd.
+
+    Product payloads are verbose JSON; compressing them shrinks the database
+    file and the page cache footprint of result reads. Rows written before
+    compression was introduced (plain JSON text) are still decoded.
+    """
+
+    impl = LargeBinary
+    cache_ok = True
+
+    ZSTD_LEVEL = 3
+    _ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+    def process_bind_param(self, value, dialect):
+        if value is None:
+            return None
+        return zstandard.compress(orjson.dumps(value), self.ZSTD_LEVEL)
+
+    def process_result_value(self, value, dialect):
+        if value is None:
+            return None
+        if isinstance(value, bytes) and value.startswith(self._ZSTD_MAGIC):
+            value = zstandard.decompress(value)
+        return orjson.loads(value)
+
+
 class Job(Base):
     __tablename__ = "jobs"
     id = Column(String, primary_key=True, index=True)
     total_urls = Column(Integer, default=0)
     status = Column(String, default="PENDING")
-    urls = Column(JSON, nullable=True)
+    urls = Column(LazyJSON, nullable=True)
     task_group_id = Column(String, nullable=True)
+    # Denormalised progress counters, bumped in the same transaction that
+    # inserts the matching ``JobResult`` rows.
+    success_count = Column(Integer, nullable=False, default=0, server_default="0")
+    failed_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Every stored result, including ``partial`` ones; the job is completed
+    # once it reaches ``total_urls``.
+    completed_count = Column(Integer, nullable=False, default=0, server_default="0")
+    # Discovered URLs left out because an earlier job already scraped them.
+    skipped_count = Column(Integer, nullable=False, default=0, server_default="0")
     results = relationship("JobResult", back_populates="job", cascade="all, delete-orphan")
 
+    __table_args__ = (Index("ix_jobs_status", "status"),)
+
 
 class JobResult(Base):
     __tablename__ = "job_results"
@@ -35,29 +142,196 @@ class JobResult(Base):
     job_id = Column(String, ForeignKey("jobs.id"), index=True, nullable=False)
     url = Column(String, nullable=False)
     status = Column(String, nullable=False)
-    data = Column(JSON, nullable=True)
+    data = Column(ZstdJSON, nullable=True)
 
     job = relationship("Job", back_populates="results")
 
+    # Covers the per-job lookups and the ``get_pending_urls`` anti-join; the
+    # second index serves ``get_scraped_urls`` across jobs.
+    __table_args__ = (
+        Index("ix_job_results_job_id_url", "job_id", "url"),
+        Index("ix_job_results_url_status", "url", "status"),
+    )
+
+
+# Bumped whenever ``init_db`` learns a new migration step. The value is stored
+# in SQLite's ``user_version`` header so up-to-date databases skip the schema
+# inspection entirely.
+SCHEMA_VERSION = 5
+
 
 def init_db() -> None:
     """Initialize database and ensure expected columns exist."""
     Base.metadata.create_all(bind=engine)
 
-    # ``create_all`` does not add new columns to existing tables. When the
-    # application is upgraded, older ``scraper.db`` files may miss recently
-    # introduced fields (e.g. the ``urls`` column).  Here we inspect the
-    # current schema and perform lightweight migrations if needed so the
-    # application can run without manual intervention.
     with engine.begin() as conn:
-        inspector = inspect(conn)
-        columns = {col["name"] for col in inspector.get_columns("jobs")}
+        version = conn.execute(text("PRAGMA user_version")).scalar() or 0
+        if version >= SCHEMA_VERSION:
+            return
+
+        if version < 1:
+            # ``create_all`` does not add new columns to existing tables. When
+            # the application is upgraded, older ``scraper.db`` files may miss
+            # recently introduced fields (e.g. the ``urls`` column).  Here we
+            # inspect the current schema and perform lightweight migrations if
+            # needed so the application can run without manual intervention.
+            inspector = inspect(conn)
+            columns = {col["name"] for col in inspector.get_columns("jobs")}
+
+            if "urls" not in columns:
+                conn.execute(text("ALTER TABLE jobs ADD COLUMN urls JSON"))
+
+            if "task_group_id" not in columns:
+                conn.execute(text("ALTER TABLE jobs ADD COLUMN task_group_id STRING"))
+
+        if version < 2:
+            # Likewise ``create_all`` skips indexes of tables that already exist.
+            for table in (Job.__table__, JobResult.__table__):
+                for index in table.indexes:
+                    index.create(conn, checkfirst=True)
+
+        if version < 3:
+            columns = {col["name"] for col in inspect(conn).get_columns("jobs")}
+            for name in ("success_count", "failed_count"):
+                if name not in columns:
+                    conn.execute(
+                        text(f"ALTER TABLE jobs ADD COLUMN {name} INTEGER NOT NULL DEFAULT 0")
+                    )
+            # Backfill the counters of jobs created before they existed.
+            conn.execute(
+                text(
+                    """
+                    UPDATE jobs SET
+                        success_count = (SELECT count(*) FROM job_results r
+                                         WHERE r.job_id = jobs.id AND r.status = 'success'),
+                        failed_count = (SELECT count(*) FROM job_results r
+                                        WHERE r.job_id = jobs.id AND r.status = 'failed')
+                    """
+                )
+            )
+
+        if version < 4:
+            columns = {col["name"] for col in inspect(conn).get_columns("jobs")}
+            if "completed_count" not in columns:
+                conn.execute(
+                    text("ALTER TABLE jobs ADD COLUMN completed_count INTEGER NOT NULL DEFAULT 0")
+                )
+            conn.execute(
+                text(
+                    """
+                    UPDATE jobs SET completed_count = (
+                        SELECT count(*) FROM job_results r WHERE r.job_id = jobs.id
+                    )
+                    """
+                )
+            )
+
+        if version < 5:
+            columns = {col["name"] for col in inspect(conn).get_columns("jobs")}
+            if "skipped_count" not in columns:
+                conn.execute(
+                    text("ALTER TABLE jobs ADD COLUMN skipped_count INTEGER NOT NULL DEFAULT 0")
+                )
+            for index in JobResult.__table__.indexes:
+                index.create(conn, checkfirst=True)
+
+        conn.execute(text(f"PRAGMA user_version = {SCHEMA_VERSION}"))
+
+
+@contextmanager
+def _session_scope(
+    session: Optional[Session] = None, write: bool = False
+) -> Iterator[Session]:
+    """Yield ``session`` if given, otherwise a short-lived one.
+
+    Writes are committed when the block exits. Reads on a caller-provided
+    session keep its transaction open so several helpers share one connection.
+    """
+    if session is None:
+        with SessionLocal() as own:
+            yield own
+            if write:
+                own.commit()
+        return
+    yield session
+    if write:
+        session.commit()
+
 
-        if "urls" not in columns:
-            conn.execute(text("ALTER TABLE jobs ADD COLUMN urls JSON"))
+def get_db() -> Iterator[Session]:
+    """FastAPI dependency providing one session per request.
 
-        if "task_group_id" not in columns:
-            conn.execute(text("ALTER TABLE jobs ADD COLUMN task_group_id STRING"))
+    Every helper accepts an optional ``session`` so an endpoint performing
+    several lookups checks out a single connection instead of one per call.
+    """
+    with SessionLocal() as session:
+        yield session
+
+
+# Hot statements are built once at import time and executed with parameters,
+# so each call skips statement construction and hits SQLAlchemy's compiled
+# cache. ``synchronize_session=False`` skips ORM identity-map bookkeeping.
+_INSERT_RESULT = insert(JobResult)
+_UPDATE_JOB_STATUS = (
+    update(Job)
+    .where(Job.id == bindparam("job_id"))
+    .values(status=bindparam("new_status"))
+    .execution_options(synchronize_session=False)
+)
+# ``task_group_id`` keeps every Celery group launched for the job (one per
+# discovered domain and per resume), comma-separated, so pausing or stopping
+# can revoke all of them.
+_ADD_JOB_GROUP = (
+    update(Job)
+    .where(Job.id == bindparam("job_id"))
+    .values(
+        task_group_id=func.coalesce(func.nullif(Job.task_group_id, "") + ",", "")
+        + bindparam("group_id")
+    )
+    .execution_options(synchronize_session=False)
+)
+_CLEAR_JOB_GROUPS = (
+    update(Job)
+    .where(Job.id == bindparam("job_id"))
+    .values(task_group_id=None)
+    .execution_options(synchronize_session=False)
+)
+# Built on the Core table so a list of parameters runs as a plain executemany
+# instead of an ORM bulk UPDATE keyed by primary key.
+_jobs = Job.__table__
+_BUMP_JOB_COUNTERS = (
+    update(_jobs)
+    .where(_jobs.c.id == bindparam("job_id"))
+    .values(
+        success_count=_jobs.c.success_count + bindparam("n_ok"),
+        failed_count=_jobs.c.failed_count + bindparam("n_fail"),
+        completed_count=_jobs.c.completed_count + bindparam("n_done"),
+    )
+)
+# Marks running jobs whose every URL has a result as completed. Run in the
+# same transaction as the counter bump, so exactly one batch sees each job
+# finish.
+_COMPLETE_FINISHED_JOBS = (
+    update(_jobs)
+    .where(
+        _jobs.c.id.in_(bindparam("job_ids", expanding=True)),
+        _jobs.c.status == "RUNNING",
+        _jobs.c.completed_count >= _jobs.c.total_urls,
+    )
+    .values(status="COMPLETED")
+    .returning(_jobs.c.id)
+)
+_JOB_EXISTS = select(literal(1)).where(Job.id == bindparam("job_id"))
+_SELECT_JOB = select(
+    Job.id,
+    Job.total_urls,
+    Job.status,
+    Job.task_group_id,
+    Job.success_count,
+    Job.failed_count,
+    Job.completed_count,
+    Job.skipped_count,
+).where(Job.id == bindparam("job_id"))
 
 
 def create_job(
@@ -65,6 +339,7 @@ def create_job(
     total: int = 0,
     urls: Optional[List[str]] = None,
     status: str = "RUNNING",
+    session: Optional[Session] = None,
 ) -> None:
     """Create or update a job entry.
 
@@ -82,89 +357,222 @@ def create_job(
         caller may pass ``"PENDING"`` to register the job before any work has
         begun.
     """
-    with SessionLocal() as session:
-        job = Job(id=job_id, total_urls=total, status=status, urls=urls)
-        session.merge(job)
-        session.commit()
-
+    stmt = sqlite_insert(Job).values(
+        id=job_id, total_urls=total, status=status, urls=urls
+    )
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[Job.id],
+        set_={
+            "total_urls": stmt.excluded.total_urls,
+            "status": stmt.excluded.status,
+            "urls": stmt.excluded.urls,
+        },
+    )
+    with _session_scope(session, write=True) as session:
+        session.execute(stmt)
+
+
+def update_job_status(job_id: str, status: str, session: Optional[Session] = None) -> None:
+    with _session_scope(session, write=True) as session:
+        session.execute(_UPDATE_JOB_STATUS, {"job_id": job_id, "new_status": status})
+
+
+def update_job_group(
+    job_id: str, group_id: str, session: Optional[Session] = None
+) -> None:
+    """Record ``group_id`` as one more task group of the job."""
+    with _session_scope(session, write=True) as session:
+        session.execute(_ADD_JOB_GROUP, {"job_id": job_id, "group_id": group_id})
 
-def update_job_status(job_id: str, status: str) -> None:
-    with SessionLocal() as session:
-        job = session.get(Job, job_id)
-        if job:
-            job.status = status
-            session.commit()
 
+def pop_job_groups(job_id: str, session: Optional[Session] = None) -> List[str]:
+    """Return every task group recorded for the job and forget them.
 
-def update_job_group(job_id: str, group_id: str) -> None:
-    with SessionLocal() as session:
-        job = session.get(Job, job_id)
-        if job:
-            job.task_group_id = group_id
-            session.commit()
+    Used when pausing or stopping: once revoked, the groups need not be
+    revoked again, and a resumed job starts recording its new groups afresh.
+    """
+    with _session_scope(session, write=True) as session:
+        raw = session.execute(
+            select(Job.task_group_id).where(Job.id == job_id)
+        ).scalar()
+        session.execute(_CLEAR_JOB_GROUPS, {"job_id": job_id})
+    return [group_id for group_id in (raw or "").split(",") if group_id]
 
 
-def get_job(job_id: str) -> Optional[dict]:
+def get_job(job_id: str, session: Optional[Session] = None) -> Optional[dict]:
     """Retrieve a job by ID and return it as a plain dictionary.
 
     Returning ORM instances after the session is closed can lead to
     ``DetachedInstanceError`` when their attributes are accessed later on.
     Converting the result to a simple ``dict`` avoids this problem and makes
-    the data easier to serialise and reason about.
+    the data easier to serialise and reason about. The (potentially huge) URL
+    list is not loaded; use :func:`get_job_urls` when it is needed.
     """
-    with SessionLocal() as session:
-        job = session.get(Job, job_id)
-        if not job:
-            return None
-        return {
-            "id": job.id,
-            "total_urls": job.total_urls,
-            "status": job.status,
-            "urls": job.urls,
-            "task_group_id": job.task_group_id,
-        }
+    with _session_scope(session) as session:
+        row = session.execute(_SELECT_JOB, {"job_id": job_id}).mappings().first()
+        return dict(row) if row else None
 
 
-def save_result(job_id: str, url: str, data: Optional[dict], status: str) -> None:
-    with SessionLocal() as session:
-        result = JobResult(job_id=job_id, url=url, data=data, status=status)
-        session.add(result)
-        session.commit()
+def get_job_urls(job_id: str, session: Optional[Session] = None) -> List[str]:
+    """Return the decoded list of URLs registered for a job."""
+    with _session_scope(session) as session:
+        raw = session.execute(select(Job.urls).where(Job.id == job_id)).scalar()
+    return orjson.loads(raw) if raw else []
 
 
-def get_results_by_job(job_id: str) -> List[dict]:
-    with SessionLocal() as session:
-        results = session.query(JobResult).filter_by(job_id=job_id).all()
-        return [
-            {"url": r.url, "status": r.status, "data": r.data}
-            for r in results
-        ]
+def save_result(
+    job_id: str,
+    url: str,
+    data: Optional[dict],
+    status: str,
+    session: Optional[Session] = None,
+) -> List[str]:
+    return save_results_bulk(
+        [{"job_id": job_id, "url": url, "data": data, "status": status}], session
+    )
+
+
+def save_results_bulk(rows: List[dict], session: Optional[Session] = None) -> List[str]:
+    """Insert many result rows in a single transaction.
+
+    Each row is a mapping with ``job_id``, ``url``, ``status`` and ``data``
+    keys. Writing a batch at once pays for one commit instead of one per URL.
+    The owning jobs' counters are bumped in the same transaction so progress
+    reads never have to aggregate ``job_results``.
+
+    Returns the ids of the jobs this batch finished, which are marked
+    ``COMPLETED`` atomically; at most one caller ever sees a given job here.
+    """
+    if not rows:
+        return []
+    counters: dict = {}
+    for row in rows:
+        n_ok, n_fail, n_done = counters.get(row["job_id"], (0, 0, 0))
+        if row["status"] == "success":
+            n_ok += 1
+        elif row["status"] == "failed":
+            n_fail += 1
+        counters[row["job_id"]] = (n_ok, n_fail, n_done + 1)
+    with _session_scope(session, write=True) as session:
+        session.execute(_INSERT_RESULT, rows)
+        session.execute(
+            _BUMP_JOB_COUNTERS,
+            [
+                {"job_id": job_id, "n_ok": n_ok, "n_fail": n_fail, "n_done": n_done}
+                for job_id, (n_ok, n_fail, n_done) in counters.items()
+            ],
+        )
+        finished = session.execute(
+            _COMPLETE_FINISHED_JOBS, {"job_ids": list(counters)}
+        ).scalars().all()
+    return list(finished)
+
+
+def update_job_urls(
+    job_id: str,
+    urls: List[str],
+    total: int,
+    skipped: int = 0,
+    session: Optional[Session] = None,
+) -> List[str]:
+    """Replace a job's URL list and total while discovery is still running.
+
+    Returns ``[job_id]`` if every URL already has a result, in which case the
+    job is marked ``COMPLETED`` in the same transaction.
+    """
+    stmt = (
+        update(_jobs)
+        .where(_jobs.c.id == job_id)
+        .values(urls=urls, total_urls=total, skipped_count=skipped)
+    )
+    with _session_scope(session, write=True) as session:
+        session.execute(stmt)
+        finished = session.execute(
+            _COMPLETE_FINISHED_JOBS, {"job_ids": [job_id]}
+        ).scalars().all()
+    return list(finished)
+
+
+# Stays well below SQLite's bound-parameter limit.
+_URL_LOOKUP_CHUNK = 500
+
+
+def get_scraped_urls(urls: List[str], session: Optional[Session] = None) -> set:
+    """Return the subset of ``urls`` already scraped successfully by any job."""
+    found: set = set()
+    with _session_scope(session) as session:
+        for start in range(0, len(urls), _URL_LOOKUP_CHUNK):
+            chunk = urls[start:start + _URL_LOOKUP_CHUNK]
+            stmt = (
+                select(JobResult.url)
+                .where(JobResult.url.in_(chunk), JobResult.status == "success")
+                .distinct()
+            )
+            found.update(session.execute(stmt).scalars())
+    return found
+
+
+def get_results_by_job(job_id: str, session: Optional[Session] = None) -> List[dict]:
+    stmt = select(JobResult.url, JobResult.status, JobResult.data).where(
+        JobResult.job_id == job_id
+    )
+    with _session_scope(session) as session:
+        return [dict(row) for row in session.execute(stmt).mappings()]
+
+
+def count_results_by_status(job_id: str, session: Optional[Session] = None) -> dict:
+    """Return a ``{status: count}`` mapping of a job's processed URLs.
+
+    Reads the counters stored on the job row instead of grouping its results.
+    """
+    stmt = select(Job.success_count, Job.failed_count).where(Job.id == job_id)
+    with _session_scope(session) as session:
+        row = session.execute(stmt).first()
+    if row is None:
+        return {}
+    return {"success": row.success_count, "failed": row.failed_count}
 
 
-def count_jobs_by_status(status: str) -> int:
-    with SessionLocal() as session:
-        return session.query(Job).filter_by(status=status).count()
+def count_jobs_by_status(status: str, session: Optional[Session] = None) -> int:
+    # A bare COUNT over ``ix_jobs_status`` rather than a subquery of ORM rows.
+    stmt = select(func.count()).select_from(Job).where(Job.status == status)
+    with _session_scope(session) as session:
+        return session.execute(stmt).scalar_one()
 
 
-def job_exists(job_id: str) -> bool:
-    return get_job(job_id) is not None
+def job_exists(job_id: str, session: Optional[Session] = None) -> bool:
+    """Check for a job with a primary-key probe, without fetching the row."""
+    with _session_scope(session) as session:
+        return session.execute(_JOB_EXISTS, {"job_id": job_id}).scalar() is not None
 
 
-def delete_job(job_id: str) -> None:
-    with SessionLocal() as session:
+def delete_job(job_id: str, session: Optional[Session] = None) -> None:
+    with _session_scope(session, write=True) as session:
         job = session.get(Job, job_id)
         if job:
             session.delete(job)
-            session.commit()
 
 
-def get_pending_urls(job_id: str) -> List[str]:
-    """Return URLs that have not yet been processed for a given job."""
-    with SessionLocal() as session:
-        job = session.get(Job, job_id)
-        if not job or not job.urls:
-            return []
-        processed = {
-            r.url for r in session.query(JobResult.url).filter_by(job_id=job_id)
-        }
-        return [url for url in job.urls if url not in processed]
+_PENDING_URLS_SQL = text(
+    """
+    SELECT j.value
+    FROM jobs, json_each(jobs.urls) AS j
+    WHERE jobs.id = :job_id
+      AND json_type(jobs.urls) = 'array'
+      AND NOT EXISTS (
+          SELECT 1 FROM job_results r
+          WHERE r.job_id = :job_id AND r.url = j.value
+      )
+    ORDER BY j.key
+    """
+)
+
+
+def get_pending_urls(job_id: str, session: Optional[Session] = None) -> List[str]:
+    """Return URLs that have not yet been processed for a given job.
+
+    The set difference is computed by SQLite (``json_each`` anti-join) so the
+    URL list never has to be decoded and diffed in Python.
+    """
+    with _session_scope(session) as session:
+        return list(session.execute(_PENDING_URLS_SQL, {"job_id": job_id}).scalars())
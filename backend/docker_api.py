@@ -0,0 +1,113 @@
+"""Scale Compose services through the Docker Engine API.
+
+Talking to the daemon over its UNIX socket avoids spawning ``docker compose``,
+which re-reads the compose file and re-plans the whole stack on every call.
+Only what ``scale_worker_containers`` needs is implemented: containers are
+started, stopped or cloned from an existing replica of the service. When that
+is not possible (no socket, no ``COMPOSE_PROJECT_NAME``, no replica to clone)
+:func:`scale_service` returns ``False`` and the caller falls back to the CLI.
+"""
+import json
+import os
+import re
+from typing import Optional
+
+import httpx
+
+DOCKER_SOCKET = os.getenv("DOCKER_SOCKET", "/var/run/docker.sock")
+# Sin proyecto no se puede acotar la búsqueda de contenedores y se tocarían
+# los ``worker`` de cualquier proyecto Compose del host.
+COMPOSE_PROJECT = os.getenv("COMPOSE_PROJECT_NAME")
+# Segundos que se espera a que un worker termine su tarea antes de matarlo.
+STOP_TIMEOUT = 30
+
+_SERVICE_LABEL = "com.docker.compose.service"
+_PROJECT_LABEL = "com.docker.compose.project"
+_NUMBER_LABEL = "com.docker.compose.container-number"
+
+_client: Optional[httpx.Client] = None
+
+
+def _get_client() -> httpx.Client:
+    global _client
+    if _client is None:
+        _client = httpx.Client(
+            transport=httpx.HTTPTransport(uds=DOCKER_SOCKET),
+            base_url="http://docker",
+            timeout=STOP_TIMEOUT + 10,
+        )
+    return _client
+
+
+def _number(container: dict) -> int:
+    return int((container.get("Labels") or {}).get(_NUMBER_LABEL, 0))
+
+
+def _list_containers(client: httpx.Client, service: str) -> list:
+    labels = [f"{_SERVICE_LABEL}={service}", f"{_PROJECT_LABEL}={COMPOSE_PROJECT}"]
+    resp = client.get(
+        "/containers/json",
+        params={"all": "1", "filters": json.dumps({"label": labels})},
+    )
+    resp.raise_for_status()
+    return sorted(resp.json(), key=_number)
+
+
+def _clone(client: httpx.Client, template_id: str, service: str, number: int) -> None:
+    """Create and start a new replica with the same configuration as ``template_id``."""
+    resp = client.get(f"/containers/{template_id}/json")
+    resp.raise_for_status()
+    info = resp.json()
+
+    config = dict(info["Config"])
+    config.pop("Hostname", None)
+    config["Labels"] = {**(config.get("Labels") or {}), _NUMBER_LABEL: str(number)}
+    networks = info["NetworkSettings"]["Networks"] or {}
+    body = {
+        **config,
+        "HostConfig": info["HostConfig"],
+        "NetworkingConfig": {
+            "EndpointsConfig": {name: {"Aliases": [service]} for name in networks}
+        },
+    }
+    template_name = info["Name"].lstrip("/")
+    name, count = re.subn(r"\d+$", str(number), template_name)
+    if not count:
+        name = f"{template_name}-{number}"
+
+    resp = client.post("/containers/create", params={"name": name}, json=body)
+    resp.raise_for_status()
+    client.post(f"/containers/{resp.json()['Id']}/start").raise_for_status()
+
+
+def scale_service(service: str, target: int) -> bool:
+    """Bring ``service`` to ``target`` running containers.
+
+    Returns ``False`` if the Engine API cannot do it and the CLI should be
+    used instead. Nothing is changed when the service is already at ``target``.
+    """
+    if not COMPOSE_PROJECT or not os.path.exists(DOCKER_SOCKET):
+        return False
+    client = _get_client()
+    containers = _list_containers(client, service)
+    running = [c for c in containers if c["State"] == "running"]
+
+    if len(running) >= target:
+        # Se detienen las réplicas con número más alto; quedan creadas para
+        # volver a arrancarlas sin coste cuando haga falta.
+        for container in running[target:]:
+            client.post(
+                f"/containers/{container['Id']}/stop", params={"t": STOP_TIMEOUT}
+            ).raise_for_status()
+        return True
+
+    missing = target - len(running)
+    for container in [c for c in containers if c["State"] != "running"][:missing]:
+        client.post(f"/containers/{container['Id']}/start").raise_for_status()
+        missing -= 1
+    if missing and not containers:
+        return False
+    next_number = max((_number(c) for c in containers), default=0) + 1
+    for offset in range(missing):
+        _clone(client, containers[0]["Id"], service, next_number + offset)
+    return True
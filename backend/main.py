@@ -1,24 +1,27 @@
 import os
 import logging
 import asyncio
-import json
 import subprocess
 import math
+import threading
+import time
+from contextlib import asynccontextmanager
 from dotenv import load_dotenv
 
 # Cargar variables de entorno ANTES de cualquier otra importación del proyecto
 load_dotenv()
 
-from fastapi import FastAPI, HTTPException, Request, APIRouter
+from fastapi import FastAPI, HTTPException, Request, APIRouter, Depends
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
-from celery import Celery, group, chord
-from pydantic import BaseModel
-from playwright.async_api import async_playwright
+from fastapi.responses import JSONResponse, ORJSONResponse
+from celery import Celery, group
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown
+from pydantic import BaseModel, ConfigDict
+from sqlalchemy.orm import Session
 
 # Importar nuestros módulos de scraping
-from scraper import crawler, browser, extractor
-from . import database
+from scraper import crawler, browser, browser_pool, extractor
+from . import database, docker_api
 from scraper import storage
 
 # Configurar logging
@@ -29,12 +32,38 @@ logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(
 celery_app = Celery("tasks", broker="redis://redis:6379/0", backend="redis://redis:6379/0")
 celery_app.conf.update(
     task_track_started=True,
-    result_extended=True
+    # msgpack es más compacto y rápido de (de)serializar que JSON; los
+    # resultados, que incluyen datos de producto, se comprimen además con zstd.
+    task_serializer="msgpack",
+    result_serializer="msgpack",
+    accept_content=["msgpack"],
+    result_compression="zstd",
+    # Nadie consulta los argumentos/nombre de las tareas en el backend.
+    result_extended=False,
+    # Conexiones persistentes y acotadas hacia Redis (broker y resultados),
+    # reutilizadas entre publicaciones en lugar de abrir una por llamada.
+    broker_pool_limit=100,
+    broker_transport_options={"socket_keepalive": True, "health_check_interval": 30},
+    redis_max_connections=64,
+    redis_socket_keepalive=True,
+    redis_backend_health_check_interval=30,
 )
 
+
+@asynccontextmanager
+async def lifespan(_app: FastAPI):
+    """Prepara el esquema una sola vez al arrancar, no al importar el módulo."""
+    database.init_db()
+    yield
+
+
 # --- Aplicación FastAPI ---
-app = FastAPI(title="Scraper API", version="1.0.0")
-database.init_db()
+app = FastAPI(
+    title="Scraper API",
+    version="1.0.0",
+    default_response_class=ORJSONResponse,
+    lifespan=lifespan,
+)
 
 # Cada trabajo de scraping requiere cinco procesos de worker por defecto para
 # acelerar la extracción. Se puede ajustar mediante variables de entorno.
@@ -43,6 +72,45 @@ WORKERS_PER_JOB = int(os.getenv("WORKERS_PER_JOB", "5"))
 # defecto para que el número total de procesos coincida con el multiplicador
 # anterior.
 WORKER_CONTAINER_CONCURRENCY = int(os.getenv("WORKER_CONCURRENCY", "5"))
+# Número de URLs que procesa cada subtarea de Celery. Agrupar URLs reduce los
+# mensajes en Redis y permite guardar sus resultados en una sola transacción.
+URL_BATCH_SIZE = int(os.getenv("URL_BATCH_SIZE", "20"))
+# URLs de un mismo lote que cada proceso de worker procesa en paralelo. El
+# trabajo es de E/S (red, Chromium, OpenAI), así que un único proceso con un
+# bucle asyncio puede solapar varias; reducir ``WORKERS_PER_JOB`` en la misma
+# proporción mantiene la concurrencia total con menos contenedores.
+URL_CONCURRENCY = int(os.getenv("URL_CONCURRENCY", "5"))
+# Omitir las URLs que algún job anterior ya extrajo con éxito. Desactivado por
+# defecto: al relanzar un catálogo normalmente se quieren precios actuales.
+SKIP_SCRAPED_URLS = os.getenv("SKIP_SCRAPED_URLS", "0") == "1"
+# Reintentos de la extracción con GPT ante fallos transitorios.
+EXTRACTION_RETRIES = 2
+
+
+# Clave de Redis con el último número de contenedores aplicado. Se comparte
+# entre la API y los workers, que también escalan al terminar un job. Caduca
+# a los ``SCALE_TARGET_TTL`` segundos para volver a aplicar el escalado si los
+# contenedores cambian por fuera (reinicios, ``docker compose down``...).
+SCALE_TARGET_KEY = "scraper:worker_target"
+SCALE_TARGET_TTL = int(os.getenv("SCALE_TARGET_TTL", "60"))
+# Las peticiones de escalado que llegan dentro de esta ventana se agrupan en
+# una sola llamada a Docker.
+SCALE_DEBOUNCE_SECONDS = float(os.getenv("SCALE_DEBOUNCE_SECONDS", "2"))
+
+
+def _last_scale_target() -> int | None:
+    try:
+        value = celery_app.backend.client.get(SCALE_TARGET_KEY)
+    except Exception:  # pragma: no cover - Redis no disponible
+        return None
+    return int(value) if value is not None else None
+
+
+def _remember_scale_target(target: int) -> None:
+    try:
+        celery_app.backend.client.set(SCALE_TARGET_KEY, target, ex=SCALE_TARGET_TTL)
+    except Exception:  # pragma: no cover - Redis no disponible
+        pass
 
 
 def scale_worker_containers() -> None:
@@ -50,8 +118,12 @@ def scale_worker_containers() -> None:
 
     Each job requires ``WORKERS_PER_JOB`` worker processes. Docker containers
     are scaled so that each container provides ``WORKER_CONTAINER_CONCURRENCY``
-    processes. Any error during scaling is logged but ignored to keep the
-    scraping flow running even when Docker is unavailable (e.g. during tests).
+    processes. The Docker Engine API is used when its socket is reachable,
+    with ``docker compose`` as fallback. Nothing is run when the target
+    matches the last applied one; that value expires after
+    ``SCALE_TARGET_TTL`` seconds so drift is corrected.
+    Any error during scaling is logged but ignored to keep the scraping flow
+    running even when Docker is unavailable (e.g. during tests).
     """
     active_jobs = database.count_jobs_by_status("RUNNING") + database.count_jobs_by_status("PENDING")
     required_workers = active_jobs * WORKERS_PER_JOB
@@ -60,7 +132,19 @@ def scale_worker_containers() -> None:
         if required_workers
         else 0
     )
+    if _last_scale_target() == target_containers:
+        return
+    try:  # pragma: no cover - depends on docker being available
+        # Primero la API de Docker por su socket: sin lanzar ``docker compose``.
+        if docker_api.scale_service("worker", target_containers):
+            _remember_scale_target(target_containers)
+            logging.info("Scaled workers to %s containers", target_containers)
+            return
+    except Exception as exc:  # pragma: no cover - best effort
+        logging.warning("Docker API scaling failed, using docker compose: %s", exc)
     try:  # pragma: no cover - depends on docker being available
+        # Sin ``--force-recreate``: compose solo recrea contenedores cuya
+        # definición haya cambiado y no reinicia los workers en marcha.
         subprocess.run(
             [
                 "docker",
@@ -68,16 +152,35 @@ def scale_worker_containers() -> None:
                 "up",
                 "--scale",
                 f"worker={target_containers}",
-                "--force-recreate",
                 "--remove-orphans",
                 "-d",
             ],
             check=True,
         )
+        _remember_scale_target(target_containers)
         logging.info("Scaled workers to %s containers", target_containers)
     except Exception as exc:  # pragma: no cover - best effort
         logging.warning("Could not scale workers: %s", exc)
 
+
+_scale_timer: threading.Timer | None = None
+_scale_lock = threading.Lock()
+
+
+def schedule_worker_scaling() -> None:
+    """Escala los workers en segundo plano, agrupando peticiones seguidas.
+
+    Los endpoints no esperan a ``docker compose``: cada llamada reinicia un
+    temporizador y solo la última de una ráfaga llega a ejecutar el escalado.
+    """
+    global _scale_timer
+    with _scale_lock:
+        if _scale_timer is not None:
+            _scale_timer.cancel()
+        _scale_timer = threading.Timer(SCALE_DEBOUNCE_SECONDS, scale_worker_containers)
+        _scale_timer.daemon = True
+        _scale_timer.start()
+
 # --- Configuración de CORS ---
 # Permite que el frontend (servido desde un archivo local) se comunique con la API.
 app.add_middleware(
@@ -106,6 +209,9 @@ async def add_cors_headers(request: Request, call_next):
     return response
 
 class ScrapeRequest(BaseModel):
+    # Rechazar campos desconocidos evita validar/copiar datos que no se usan.
+    model_config = ConfigDict(extra="forbid")
+
     domains: list[str]
 
 # The API endpoints are registered on an ``APIRouter`` which is mounted twice:
@@ -116,144 +222,368 @@ router = APIRouter()
 
 # --- Tareas de Celery ---
 
-@celery_app.task(name="process_url_task", bind=True, acks_late=True, max_retries=2)
-def process_url_task(self, job_id: str, url: str):
-    """Tarea síncrona que envuelve la lógica asíncrona de scraping."""
-    return asyncio.run(scrape_single_url(self, job_id, url))
+# --- Recursos persistentes por proceso de worker ---
+# Cada proceso de worker mantiene un único bucle de eventos y un pool de
+# Chromium (``browser_pool``) que se reutilizan entre tareas; por URL solo se
+# crea un ``BrowserContext``.
+_worker_loop: asyncio.AbstractEventLoop | None = None
 
-async def scrape_single_url(task_self, job_id: str, url: str):
-    """Lógica asíncrona real para procesar una única URL."""
-    logging.info(f"[URL Task] Iniciando procesamiento de: {url}")
+
+def _get_worker_loop() -> asyncio.AbstractEventLoop:
+    """Devuelve el bucle persistente del proceso, creándolo si hace falta.
+
+    Si el bucle llegara a cerrarse (p. ej. tras un fallo grave), se crea uno
+    nuevo en lugar de fallar en todas las tareas siguientes.
+    """
+    global _worker_loop
+    if _worker_loop is None or _worker_loop.is_closed():
+        _worker_loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(_worker_loop)
+    return _worker_loop
+
+
+@worker_init.connect
+def _init_worker(**_):
+    """Prepara el esquema una vez en el proceso principal, antes del fork."""
+    database.init_db()
+
+
+@worker_process_init.connect
+def _init_worker_process(**_):
+    """Lanza el pool de Chromium una sola vez al arrancar cada proceso de worker."""
+    try:
+        _get_worker_loop().run_until_complete(browser_pool.pool.warmup())
+    except Exception as exc:  # pragma: no cover - depende de Playwright
+        logging.warning("No se pudo precargar el navegador: %s", exc)
+
+
+@worker_process_shutdown.connect
+def _shutdown_worker_process(**_):
+    """Cierra el navegador y vacía ``results.jsonl`` antes de salir."""
+    storage.results_writer.flush()
+    if _worker_loop is not None and not _worker_loop.is_closed():
+        try:
+            _worker_loop.run_until_complete(browser_pool.pool.close())
+            _worker_loop.run_until_complete(browser.close_http_client())
+        except Exception as exc:  # pragma: no cover - best effort
+            logging.warning("No se pudo cerrar el navegador: %s", exc)
+
+
+def _batched(items: list, size: int) -> list[list]:
+    """Divide ``items`` en listas consecutivas de como máximo ``size`` elementos."""
+    return [items[i:i + size] for i in range(0, len(items), size)]
+
+
+@celery_app.task(name="process_url_task", bind=True, acks_late=True)
+def process_url_task(self, job_id: str, urls: list[str]):
+    """Tarea síncrona que procesa un lote de URLs en el bucle del worker."""
+    return _get_worker_loop().run_until_complete(scrape_url_batch(job_id, urls))
+
+async def scrape_url_batch(job_id: str, urls: list[str]) -> list[dict]:
+    """Procesa ``urls`` y guarda todas sus filas en una sola transacción.
+
+    Hasta ``URL_CONCURRENCY`` URLs del lote se procesan a la vez en el bucle
+    del worker; las que necesitan navegador usan contextos del pool.
+    """
+    semaphore = asyncio.Semaphore(URL_CONCURRENCY)
+
+    async def run(url: str):
+        async with semaphore:
+            return await scrape_single_url(job_id, url)
+
+    outcomes = await asyncio.gather(*(run(url) for url in urls), return_exceptions=True)
+    results = []
+    rows = []
+    error = None
+    for outcome in outcomes:
+        if isinstance(outcome, BaseException):
+            error = error or outcome
+            continue
+        result, row = outcome
+        results.append(result)
+        if row:
+            rows.append(row)
+
+    finished = storage.save_products(rows)
+    if finished:
+        # Este lote completó el job (ya marcado COMPLETED en la misma
+        # transacción): se finaliza aquí mismo, sin chord ni tarea de callback.
+        _finish_jobs(finished)
+    if error is not None:
+        raise error
+    return results
+
+
+def _finish_jobs(job_ids: list[str]) -> None:
+    """Registra el resumen de los jobs recién completados y reescala.
+
+    Se llama desde el bucle del worker, así que el escalado se programa en
+    segundo plano en lugar de esperar a Docker.
+    """
+    for job_id in job_ids:
+        job = database.get_job(job_id) or {}
+        logging.info(
+            f"[Finalize] Job {job_id} completado. "
+            f"{job.get('success_count', 0)}/{job.get('total_urls', 0)} URLs procesadas exitosamente."
+        )
+    schedule_worker_scaling()
+
+# Jobs que este proceso ha visto en ``RUNNING`` y cuándo: ``{job_id: instante}``.
+# El estado solo cambia al pausar/cancelar, así que basta con releerlo cada
+# pocos segundos en lugar de consultar SQLite por cada URL. Los demás estados
+# no se guardan: tras reanudar un job sus URLs no deben saltarse por un
+# ``PAUSED`` antiguo.
+_RUNNING_JOBS: dict[str, float] = {}
+JOB_STATUS_TTL = float(os.getenv("JOB_STATUS_TTL", "2"))
+
+
+def _job_is_running(job_id: str) -> bool:
+    now = time.monotonic()
+    seen = _RUNNING_JOBS.get(job_id)
+    if seen is not None and now - seen < JOB_STATUS_TTL:
+        return True
     job = database.get_job(job_id)
     if not job or job["status"] != "RUNNING":
+        _RUNNING_JOBS.pop(job_id, None)
+        return False
+    if len(_RUNNING_JOBS) >= 1024:
+        _RUNNING_JOBS.clear()
+    _RUNNING_JOBS[job_id] = now
+    return True
+
+
+async def _extract_with_retries(url: str, html: str, retries: int) -> dict | None:
+    """Extrae el producto de ``html`` reintentando si el LLM no devuelve datos.
+
+    Los ``ValueError`` del extractor (HTML vacío, error de extracción) se propagan.
+    """
+    # El HTML se limpia una sola vez y el texto se reutiliza en los reintentos
+    text = extractor.prepare_text(html)
+    for attempt in range(retries + 1):
+        product_data = await extractor.extract_product_data_from_html(url, html, text)
+        if product_data or attempt == retries:
+            return product_data
+        # Reintento automático en caso de fallo transitorio del LLM
+        logging.info(f"[URL Task] Reintentando extracción para {url}")
+        await asyncio.sleep(5)
+
+
+async def scrape_single_url(job_id: str, url: str) -> tuple[dict, dict | None]:
+    """Lógica asíncrona real para procesar una única URL.
+
+    Devuelve el resumen de la tarea y la fila a persistir (``None`` si la URL
+    se omitió porque el job ya no está activo).
+    """
+    logging.info(f"[URL Task] Iniciando procesamiento de: {url}")
+    if not _job_is_running(job_id):
         logging.info(f"[URL Task] Job {job_id} no activo. Saltando {url}")
-        return {"url": url, "status": "skipped"}
+        return {"url": url, "status": "skipped"}, None
+
+    def outcome(status: str, data: dict, reason: str | None = None):
+        result = {"url": url, "status": status}
+        if reason:
+            result["reason"] = reason
+        return result, {"job_id": job_id, "url": url, "data": data, "status": status}
+
     try:
-        async with async_playwright() as pw:
-            pw_browser = await pw.chromium.launch(headless=True)
-            context = await browser.create_context(pw_browser, proxy=os.getenv("SCRAPER_PROXY"))
+        # Sin proxy se prueba primero un GET simple; solo las páginas que
+        # dependen de JavaScript ocupan un contexto de navegador.
+        proxy = os.getenv("SCRAPER_PROXY")
+        html = None if proxy else await browser.fetch_static_html(url)
+        static = html is not None
+        while True:
+            if html is None:
+                async with browser_pool.pool.context(
+                    lambda pw_browser: browser.create_context(pw_browser, proxy=proxy)
+                ) as context:
+                    html = await browser.get_html_from_url(context, url)
+            if not html:
+                reason = "No se pudo obtener HTML"
+                return outcome("failed", {"reason": reason}, reason)
+
             try:
-                html = await browser.get_html_from_url(context, url)
-                if not html:
-                    storage.save_product(job_id, url, {"reason": "No se pudo obtener HTML"}, "failed")
-                    return {"url": url, "status": "failed", "reason": "No se pudo obtener HTML"}
-
-                try:
-                    product_data = await extractor.extract_product_data_from_html(url, html)
-                except ValueError as err:
+                # Con HTML estático no se reintenta: se pasa antes al navegador.
+                product_data = await _extract_with_retries(
+                    url, html, 0 if static else EXTRACTION_RETRIES
+                )
+            except ValueError as err:
+                if static and str(err) == "EMPTY_CONTENT":
+                    product_data = None
+                else:
                     reason = "HTML sin contenido" if str(err) == "EMPTY_CONTENT" else "Error de extracción"
                     fallback = extractor.fallback_basic_extraction(url, html)
                     if fallback:
-                        storage.save_product(job_id, url, fallback, "partial")
-                        return {"url": url, "status": "partial", "reason": reason}
-                    storage.save_product(job_id, url, {"reason": reason}, "failed")
-                    return {"url": url, "status": "failed", "reason": reason}
-
-                if not product_data:
-                    # Reintento automático en caso de fallo transitorio del LLM
-                    if task_self.request.retries < task_self.max_retries:
-                        logging.info(f"[URL Task] Reintentando extracción para {url}")
-                        raise task_self.retry(countdown=5)
-                    fallback = extractor.fallback_basic_extraction(url, html)
-                    if fallback:
-                        storage.save_product(job_id, url, fallback, "partial")
-                        return {"url": url, "status": "partial", "reason": "Extracción LLM fallida"}
-                    storage.save_product(job_id, url, {"reason": "No se pudieron extraer datos"}, "failed")
-                    return {"url": url, "status": "failed", "reason": "No se pudieron extraer datos"}
-
-                # Guardar en archivo y base de datos
-                with open("results.jsonl", "a", encoding="utf-8") as f:
-                    f.write(json.dumps(product_data, ensure_ascii=False) + "\n")
-                storage.save_product(job_id, url, product_data, "success")
-
-                return {"url": url, "status": "success", "data": product_data['title']}
-            finally:
-                await context.close()
-                await pw_browser.close()
+                        return outcome("partial", fallback, reason)
+                    return outcome("failed", {"reason": reason}, reason)
+            if product_data or not static:
+                break
+            # El HTML estático no bastaba: cuenta como fallo de la ruta rápida
+            # y se repite con Playwright.
+            logging.info(f"[URL Task] HTML estático insuficiente para {url}; usando navegador")
+            browser.record_static_miss(url)
+            html, static = None, False
+
+        if not product_data:
+            fallback = extractor.fallback_basic_extraction(url, html)
+            if fallback:
+                return outcome("partial", fallback, "Extracción LLM fallida")
+            reason = "No se pudieron extraer datos"
+            return outcome("failed", {"reason": reason}, reason)
+
+        # Guardar en archivo; la fila de base de datos se escribe con el lote
+        await storage.append_result_line_async(product_data)
+        result, row = outcome("success", product_data)
+        result["data"] = product_data.get("title")
+        return result, row
     except Exception as e:
         logging.exception(f"[URL Task] Falla catastrófica en {url}: {e}")
-        task_self.update_state(state='FAILURE', meta=str(e))
-        raise
+        return outcome("failed", {"reason": str(e)}, str(e))
 
 
-@celery_app.task(name="finalize_scraping_task", bind=True)
-def finalize_scraping_task(self, results, job_id: str):
-    """Tarea que se ejecuta al finalizar todas las subtareas."""
-    total = len(results)
-    success = sum(1 for r in results if r and r.get("status") == "success")
-    database.update_job_status(job_id, "COMPLETED")
-    scale_worker_containers()
-    logging.info(
-        f"[Finalize] Job {job_id} completado. {success}/{total} URLs procesadas exitosamente."
-    )
-    return {
-        "status": "Completed",
-        "total_urls_processed": total,
-        "products_found": success,
-    }
-
 @celery_app.task(name="start_scraping_task", bind=True)
 def start_scraping_task(self, domains: list[str]):
     """Tarea principal síncrona que orquesta el scraping de dominios."""
-    # Usar el bucle de eventos existente en lugar de asyncio.run() para evitar conflictos
-    loop = asyncio.get_event_loop()
-    return loop.run_until_complete(orchestrate_scraping(self, domains))
+    # Reutilizar el bucle persistente del worker en lugar de asyncio.run()
+    return _get_worker_loop().run_until_complete(orchestrate_scraping(self, domains))
 
 async def orchestrate_scraping(task_self, domains: list[str]):
-    """Lógica de orquestación asíncrona para el scraping."""
+    """Lógica de orquestación asíncrona para el scraping.
+
+    Cada dominio se encola en cuanto termina su descubrimiento, de modo que el
+    scraping de los primeros dominios se solapa con el descubrimiento del resto.
+    """
     logging.info(f"[Main Task] Descubriendo URLs para: {domains}")
-    
+    job_id = task_self.request.id
+
     try:
-        url_lists = await asyncio.gather(
-            *[crawler.get_urls_for_domain(domain) for domain in domains]
-        )
-        all_urls = [url for sublist in url_lists for url in sublist]
+        all_urls: list[str] = []
+        seen: set[str] = set()
+        skipped = 0
+        group_id = None
+        remaining = len(domains)
+        for discovery in asyncio.as_completed(
+            [crawler.get_urls_for_domain(domain) for domain in domains]
+        ):
+            urls = await discovery
+            remaining -= 1
+            # Sin duplicados, ni dentro del dominio ni entre dominios.
+            urls = [url for url in dict.fromkeys(urls) if url not in seen]
+            seen.update(urls)
+            if SKIP_SCRAPED_URLS and urls:
+                scraped = database.get_scraped_urls(urls)
+                skipped += len(scraped)
+                urls = [url for url in urls if url not in scraped]
+            if not urls:
+                continue
+            all_urls.extend(urls)
+            # Mientras queden dominios por descubrir, el total se infla en uno
+            # por dominio para que el job no pueda darse por completado antes
+            # de tiempo; al terminar se fija el total real.
+            total_urls = len(all_urls) + remaining
+            if len(all_urls) == len(urls):
+                database.create_job(job_id, total_urls, all_urls)
+                # En segundo plano: ``docker compose`` no debe frenar el
+                # descubrimiento de los demás dominios en este bucle.
+                schedule_worker_scaling()
+            else:
+                database.update_job_urls(job_id, all_urls, total_urls, skipped)
+            logging.info(f"Se descubrieron {len(urls)} URLs ({len(all_urls)} en total)")
+
+            group_id = _launch_batches(job_id, urls)
+            task_self.update_state(
+                state="PROGRESS",
+                meta={
+                    "task_group_id": group_id,
+                    "total": total_urls,
+                    "status": "Procesando URLs...",
+                },
+            )
+            logging.info(f"Grupo de tareas {group_id} lanzado.")
 
         if not all_urls:
-            logging.warning("[Main Task] No se encontraron URLs para procesar.")
+            logging.warning(
+                f"[Main Task] No se encontraron URLs para procesar ({skipped} ya extraídas)."
+            )
+            # Sin esto el job quedaría en PENDING y contaría como activo al escalar.
+            database.create_job(job_id, 0, [], status="COMPLETED")
+            database.update_job_urls(job_id, [], 0, skipped)
+            schedule_worker_scaling()
             task_self.update_state(state="SUCCESS", meta={"status": "No URLs found"})
-            return {"status": "No URLs found", "total": 0}
+            return {"status": "No URLs found", "total": 0, "skipped": skipped}
 
         total_urls = len(all_urls)
-        job_id = task_self.request.id
-        database.create_job(job_id, total_urls, all_urls)
-        scale_worker_containers()
-
-        task_self.update_state(
-            state="PROGRESS",
-            meta={"total": total_urls, "status": "Descubriendo URLs..."},
-        )
+        finished = database.update_job_urls(job_id, all_urls, total_urls, skipped)
+        if finished:
+            # Los lotes terminaron antes que el descubrimiento.
+            _finish_jobs(finished)
         logging.info(
             f"Se descubrieron {total_urls} URLs para los dominios: {domains}"
         )
 
-        task_chord = chord(
-            process_url_task.s(job_id, url) for url in all_urls
-        )(finalize_scraping_task.s(job_id))
-        database.update_job_group(job_id, task_chord.id)
-
-        task_self.update_state(
-            state="PROGRESS",
-            meta={
-                "task_group_id": task_chord.id,
-                "total": total_urls,
-                "status": "Procesando URLs...",
-            },
-        )
-        logging.info(f"Grupo de tareas {task_chord.id} lanzado.")
-
         return {
             "status": "Started",
             "total_urls": total_urls,
-            "task_group_id": task_chord.id,
+            "skipped_urls": skipped,
+            "task_group_id": group_id,
         }
     except Exception as e:
-        job_id = task_self.request.id
         logging.exception("[Main Task] Error durante la orquestación")
         database.update_job_status(job_id, "FAILED")
         task_self.update_state(state="FAILURE", meta={"error": str(e)})
         raise
 
+def _launch_batches(job_id: str, urls: list[str], session=None) -> str:
+    """Encola ``urls`` en lotes como un grupo de Celery y devuelve su id.
+
+    No hay callback de chord: el lote que guarda el último resultado marca el
+    job como completado (ver ``scrape_url_batch``). El grupo se guarda en el
+    backend y se añade a los del job (uno por dominio descubierto y por
+    reanudación) para que pausar/cancelar pueda revocar todas sus subtareas.
+    """
+    result_group = group(
+        process_url_task.s(job_id, batch) for batch in _batched(urls, URL_BATCH_SIZE)
+    ).apply_async()
+    result_group.save()
+    database.update_job_group(job_id, result_group.id, session=session)
+    return result_group.id
+
+
+# Caché de ``GroupResult`` restaurados, indexados por id de grupo.
+_GROUP_CACHE: dict = {}
+_GROUP_CACHE_SIZE = 1024
+
+
+def _restore_group(group_id: str):
+    """Restore a Celery ``GroupResult`` once per group id.
+
+    Group membership never changes after the group is launched, so the Redis
+    round-trip that fetches the member list only needs to happen once. Misses
+    are not cached because the group may not have been saved yet.
+    """
+    group_result = _GROUP_CACHE.get(group_id)
+    if group_result is None:
+        group_result = celery_app.GroupResult.restore(group_id)
+        if group_result is not None:
+            if len(_GROUP_CACHE) >= _GROUP_CACHE_SIZE:
+                _GROUP_CACHE.pop(next(iter(_GROUP_CACHE)))
+            _GROUP_CACHE[group_id] = group_result
+    return group_result
+
+
+# Ids por mensaje de revocación, para no generar mensajes de pub/sub enormes.
+REVOKE_CHUNK_SIZE = 1000
+
+
+def _revoke_group(group_id: str) -> None:
+    """Revoca las subtareas de un grupo con un mensaje de control por bloque."""
+    group_result = _restore_group(group_id)
+    if not group_result or not group_result.children:
+        return
+    ids = [child.id for child in group_result.children]
+    for chunk in _batched(ids, REVOKE_CHUNK_SIZE):
+        celery_app.control.revoke(chunk, terminate=True, signal="SIGTERM")
+
+
 # --- Endpoints de la API ---
 
 @router.get("/", summary="Endpoint de prueba")
@@ -261,7 +591,7 @@ def read_root():
     return {"status": "ok", "message": "Bienvenido a la API de Scraper 2.0"}
 
 @router.post("/scrape", summary="Iniciar un nuevo trabajo de scraping", status_code=202)
-async def create_scraping_job(req: ScrapeRequest):
+async def create_scraping_job(req: ScrapeRequest, db: Session = Depends(database.get_db)):
     if not req.domains:
         raise HTTPException(status_code=400, detail="La lista de dominios no puede estar vacía.")
     if not os.getenv("OPENAI_API_KEY"):
@@ -278,29 +608,30 @@ async def create_scraping_job(req: ScrapeRequest):
     # frontend pueda consultar su estado sin esperar a que Celery descubra
     # las URLs. El número total y la lista de URLs se actualizarán una vez que
     # la tarea principal haya terminado la fase de descubrimiento.
-    database.create_job(task.id, status="PENDING")
-    scale_worker_containers()
+    database.create_job(task.id, status="PENDING", session=db)
+    schedule_worker_scaling()
 
     return {"message": "Trabajo de scraping iniciado", "task_id": task.id}
 
 
 @router.get("/scrape/results/{task_id}", summary="Obtener resultados de un trabajo")
-async def get_scraping_results(task_id: str):
-    if not database.job_exists(task_id):
+async def get_scraping_results(task_id: str, db: Session = Depends(database.get_db)):
+    if not database.job_exists(task_id, session=db):
         raise HTTPException(status_code=404, detail="Job not found")
-    results = database.get_results_by_job(task_id)
+    results = database.get_results_by_job(task_id, session=db)
     return {"task_id": task_id, "results": results}
 
 @router.get("/scrape/status/{task_id}", summary="Consultar estado de un trabajo")
-async def get_scraping_status(task_id: str):
-    job = database.get_job(task_id)
+async def get_scraping_status(task_id: str, db: Session = Depends(database.get_db)):
+    job = database.get_job(task_id, session=db)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
 
-    results = database.get_results_by_job(task_id)
-    success = sum(1 for r in results if r["status"] == "success")
-    failed = sum(1 for r in results if r["status"] == "failed")
-    completed = success + failed
+    # Contadores desnormalizados del job, actualizados en la misma transacción
+    # que guarda los resultados; ``completed`` incluye también los ``partial``.
+    completed = job["completed_count"]
+    success = job["success_count"]
+    failed = job["failed_count"]
     percent = (completed / job["total_urls"] * 100) if job["total_urls"] else 0
 
     error_detail = None
@@ -320,6 +651,7 @@ async def get_scraping_status(task_id: str):
             "completed": completed,
             "success": success,
             "failed": failed,
+            "skipped": job["skipped_count"],
             "percent": f"{percent:.2f}%",
         },
         "error": error_detail,
@@ -327,67 +659,63 @@ async def get_scraping_status(task_id: str):
 
 
 @router.post("/scrape/pause/{task_id}", summary="Pausar un trabajo en ejecución")
-async def pause_job(task_id: str):
-    job = database.get_job(task_id)
+async def pause_job(task_id: str, db: Session = Depends(database.get_db)):
+    job = database.get_job(task_id, session=db)
     if not job or job["status"] != "RUNNING":
         raise HTTPException(status_code=400, detail="Job not running")
-    if job["task_group_id"]:
-        group_result = celery_app.GroupResult.restore(job["task_group_id"])
-        if group_result:
-            for child in group_result.children:
-                celery_app.control.revoke(child.id, terminate=True)
-    database.update_job_status(task_id, "PAUSED")
-    scale_worker_containers()
+    # Primero el estado: las subtareas aún en cola lo comprueban y se
+    # descartan solas aunque la revocación no les llegue.
+    database.update_job_status(task_id, "PAUSED", session=db)
+    for group_id in database.pop_job_groups(task_id, session=db):
+        _revoke_group(group_id)
+    schedule_worker_scaling()
     return {"status": "paused"}
 
 
 @router.post("/scrape/resume/{task_id}", summary="Reanudar un trabajo pausado")
-async def resume_job(task_id: str):
-    job = database.get_job(task_id)
+async def resume_job(task_id: str, db: Session = Depends(database.get_db)):
+    job = database.get_job(task_id, session=db)
     if not job or job["status"] != "PAUSED":
         raise HTTPException(status_code=400, detail="Job not paused")
-    pending = database.get_pending_urls(task_id)
+    pending = database.get_pending_urls(task_id, session=db)
     if not pending:
-        database.update_job_status(task_id, "COMPLETED")
-        scale_worker_containers()
+        database.update_job_status(task_id, "COMPLETED", session=db)
+        schedule_worker_scaling()
         return {"status": "completed"}
-    tasks_group = group(process_url_task.s(task_id, url) for url in pending)
-    result_group = tasks_group.apply_async()
-    database.update_job_group(task_id, result_group.id)
-    database.update_job_status(task_id, "RUNNING")
-    scale_worker_containers()
+    database.update_job_status(task_id, "RUNNING", session=db)
+    _launch_batches(task_id, pending, session=db)
+    schedule_worker_scaling()
     return {"status": "resumed", "pending": len(pending)}
 
 
 @router.post("/scrape/stop/{task_id}", summary="Cancelar un trabajo")
-async def stop_job(task_id: str):
-    job = database.get_job(task_id)
+async def stop_job(task_id: str, db: Session = Depends(database.get_db)):
+    job = database.get_job(task_id, session=db)
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-    if job["task_group_id"]:
-        group_result = celery_app.GroupResult.restore(job["task_group_id"])
-        if group_result:
-            for child in group_result.children:
-                celery_app.control.revoke(child.id, terminate=True)
-    database.update_job_status(task_id, "CANCELLED")
-    scale_worker_containers()
+    # Primero el estado: las subtareas aún en cola lo comprueban y se
+    # descartan solas aunque la revocación no les llegue.
+    database.update_job_status(task_id, "CANCELLED", session=db)
+    for group_id in database.pop_job_groups(task_id, session=db):
+        _revoke_group(group_id)
+    schedule_worker_scaling()
     return {"status": "cancelled"}
 
 
 @router.delete("/scrape/{task_id}", summary="Eliminar un trabajo y sus resultados")
-async def delete_job(task_id: str):
-    if not database.job_exists(task_id):
+async def delete_job(task_id: str, db: Session = Depends(database.get_db)):
+    if not database.job_exists(task_id, session=db):
         raise HTTPException(status_code=404, detail="Job not found")
-    database.delete_job(task_id)
+    database.delete_job(task_id, session=db)
     return {"status": "deleted"}
 
 
 @router.get("/scrape/download/{task_id}", summary="Descargar resultados de un trabajo")
-async def download_results(task_id: str):
-    if not database.job_exists(task_id):
+async def download_results(task_id: str, db: Session = Depends(database.get_db)):
+    if not database.job_exists(task_id, session=db):
         raise HTTPException(status_code=404, detail="Job not found")
-    results = database.get_results_by_job(task_id)
-    return JSONResponse(content=results)
+    results = database.get_results_by_job(task_id, session=db)
+    return ORJSONResponse(results)
 
 
 # Expose the same routes both at ``/`` and ``/api`` so that the frontend running
@@ -0,0 +1,67 @@
+import asyncio
+import importlib
+from contextlib import asynccontextmanager
+
+from scraper import browser
+
+NAV = "<nav>" + "".join(f'<a href="/c{i}">Categoría número {i}</a>' for i in range(40)) + "</nav>"
+
+
+def test_client_rendered_shell_with_big_menu_is_not_static():
+    html = f"<html><body><header>{NAV}</header><div id='root'></div><script>app()</script></body></html>"
+    assert not browser.looks_server_rendered(html)
+
+
+def test_server_rendered_product_page_is_static():
+    description = "Crema hidratante para piel seca con ácido hialurónico. " * 12
+    html = f"<html><body>{NAV}<main><h1>Crema</h1><p>{description}</p></main></body></html>"
+    assert browser.looks_server_rendered(html)
+
+
+def test_product_json_ld_is_static():
+    html = '<html><body><script type="application/ld+json">{"@type": "Product"}</script></body></html>'
+    assert browser.looks_server_rendered(html)
+
+
+def test_static_miss_falls_back_to_browser(monkeypatch, tmp_path):
+    monkeypatch.setenv("SCRAPER_DB", str(tmp_path / "test.db"))
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    monkeypatch.delenv("SCRAPER_PROXY", raising=False)
+    from backend import database
+    importlib.reload(database)
+    database.init_db()
+    import backend.main as main
+    importlib.reload(main)
+
+    url = "https://shop.example/p/1"
+    browser._static_stats["shop.example"] = [1, 1]
+
+    async def fetch_static_html(u):
+        return "<html>static</html>"
+
+    async def get_html_from_url(context, u):
+        return "<html>rendered</html>"
+
+    @asynccontextmanager
+    async def context(factory):
+        yield object()
+
+    async def extract(u, html, text):
+        return {"title": "Crema"} if "rendered" in html else None
+
+    async def append(data):
+        pass
+
+    monkeypatch.setattr(main, "_job_is_running", lambda job_id: True)
+    monkeypatch.setattr(main.browser, "fetch_static_html", fetch_static_html)
+    monkeypatch.setattr(main.browser, "get_html_from_url", get_html_from_url)
+    monkeypatch.setattr(main.browser_pool.pool, "context", context)
+    monkeypatch.setattr(main.extractor, "prepare_text", lambda html: html)
+    monkeypatch.setattr(main.extractor, "extract_product_data_from_html", extract)
+    monkeypatch.setattr(main.storage, "append_result_line_async", append)
+
+    result, row = asyncio.run(main.scrape_single_url("job1", url))
+    assert result["status"] == "success"
+    assert row["data"] == {"title": "Crema"}
+    assert browser._static_stats["shop.example"] == [0, 1]
+    browser._static_stats.pop("shop.example")
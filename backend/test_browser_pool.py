@@ -0,0 +1,114 @@
+import asyncio
+
+from scraper.browser_pool import BrowserPool
+
+
+class FakeContext:
+    def __init__(self):
+        self.closed = False
+
+    async def close(self):
+        self.closed = True
+
+
+class FakeBrowser:
+    def __init__(self):
+        self.connected = True
+
+    def is_connected(self):
+        return self.connected
+
+    async def close(self):
+        self.connected = False
+
+
+def test_pool_reuses_and_recycles_browsers(monkeypatch):
+    pool = BrowserPool(size=1, recycle_after=2)
+    launched = []
+
+    async def fake_launch():
+        browser = FakeBrowser()
+        launched.append(browser)
+        pool._uses[browser] = 0
+        return browser
+
+    monkeypatch.setattr(pool, "_launch", fake_launch)
+
+    async def scenario():
+        first = await pool.acquire()
+        pool.release(first)
+        assert await pool.acquire() is first
+        pool.release(first)  # second use: retired
+        replacement = await pool.acquire()
+        pool.release(replacement)
+        await pool.close()
+        return first, replacement
+
+    first, replacement = asyncio.run(scenario())
+    assert replacement is not first
+    assert len(launched) == 2
+    assert not first.connected and not replacement.connected
+
+
+def test_pool_reuses_and_recycles_contexts(monkeypatch):
+    pool = BrowserPool(size=1, recycle_after=100, context_recycle_after=2)
+    browser = FakeBrowser()
+    pool._uses[browser] = 0
+    pool._idle.put_nowait(browser)
+    created = []
+
+    async def factory(_browser):
+        context = FakeContext()
+        created.append(context)
+        return context
+
+    async def scenario():
+        used = []
+        for _ in range(3):
+            async with pool.context(factory) as context:
+                used.append(context)
+        try:
+            async with pool.context(factory):
+                raise RuntimeError("boom")
+        except RuntimeError:
+            pass
+        return used
+
+    used = asyncio.run(scenario())
+    # Second page retires the first context; the failing block closes the other.
+    assert used == [created[0], created[0], created[1]]
+    assert created[0].closed and created[1].closed
+    assert not pool._contexts
+
+
+def test_pool_lends_one_browser_to_concurrent_callers(monkeypatch):
+    pool = BrowserPool(size=1, recycle_after=100, max_leases=5)
+    launched = []
+
+    async def fake_launch():
+        browser = FakeBrowser()
+        launched.append(browser)
+        pool._uses[browser] = 0
+        return browser
+
+    monkeypatch.setattr(pool, "_launch", fake_launch)
+
+    async def factory(_browser):
+        return FakeContext()
+
+    async def fetch():
+        async with pool.context(factory):
+            await asyncio.sleep(0.2)
+
+    async def scenario():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await asyncio.gather(*[fetch() for _ in range(5)])
+        elapsed = loop.time() - start
+        await pool.close()
+        return elapsed
+
+    elapsed = asyncio.run(scenario())
+    # The five leases overlap on a single browser instead of queuing.
+    assert elapsed < 0.5
+    assert len(launched) == 1
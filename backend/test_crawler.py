@@ -0,0 +1,18 @@
+from scraper import crawler
+
+
+def test_parse_sitemap_does_not_resolve_external_entities(tmp_path):
+    secret = tmp_path / "secret.txt"
+    secret.write_text("contenido-privado")
+    xml = (
+        '<?xml version="1.0"?>'
+        f'<!DOCTYPE urlset [<!ENTITY x SYSTEM "file://{secret}">]>'
+        '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">'
+        "<url><loc>https://example.com/&x;</loc></url>"
+        "<url><loc>https://example.com/p/1</loc></url>"
+        "</urlset>"
+    ).encode()
+    is_index, urls = crawler._parse_sitemap(xml)
+    assert not is_index
+    assert "https://example.com/p/1" in urls
+    assert not any("contenido-privado" in url for url in urls)
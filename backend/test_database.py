@@ -0,0 +1,76 @@
+import importlib
+
+import pytest
+
+
+@pytest.fixture
+def database(monkeypatch, tmp_path):
+    monkeypatch.setenv("SCRAPER_DB", str(tmp_path / "test.db"))
+    from backend import database
+    importlib.reload(database)
+    database.init_db()
+    yield database
+    # Restaurar el entorno y volver a cargar el módulo con la base de datos
+    # original para no arrastrar la temporal a otros tests.
+    monkeypatch.undo()
+    importlib.reload(database)
+
+
+def test_pending_urls_excludes_processed(database):
+    database.create_job("job1", total=3, urls=["a", "b", "c"])
+    database.save_results_bulk(
+        [
+            {"job_id": "job1", "url": "b", "data": None, "status": "failed"},
+            {"job_id": "job2", "url": "c", "data": None, "status": "success"},
+        ]
+    )
+
+    assert database.get_pending_urls("job1") == ["a", "c"]
+    assert database.get_pending_urls("missing") == []
+
+    database.create_job("job3", status="PENDING")
+    assert database.get_pending_urls("job3") == []
+
+
+def test_create_job_upserts_existing_row(database):
+    database.create_job("job1", status="PENDING")
+    database.update_job_group("job1", "group1")
+    database.create_job("job1", total=2, urls=["a", "b"])
+
+    job = database.get_job("job1")
+    assert job["status"] == "RUNNING"
+    assert job["total_urls"] == 2
+    assert job["task_group_id"] == "group1"
+
+
+def test_save_results_bulk_bumps_counters_and_completes_job(database):
+    database.create_job("job1", total=3, urls=["a", "b", "c"])
+    database.save_results_bulk(
+        [
+            {"job_id": "job1", "url": "a", "data": {"name": "x"}, "status": "success"},
+            {"job_id": "job1", "url": "b", "data": None, "status": "failed"},
+        ]
+    )
+    assert database.get_job("job1")["status"] == "RUNNING"
+    finished = database.save_result("job1", "c", {"name": "y"}, "partial")
+
+    assert finished == ["job1"]
+    assert database.count_results_by_status("job1") == {"success": 1, "failed": 1}
+    job = database.get_job("job1")
+    assert (job["success_count"], job["failed_count"], job["completed_count"]) == (1, 1, 3)
+    assert job["status"] == "COMPLETED"
+    assert database.count_jobs_by_status("RUNNING") == 0
+    # A late duplicate does not finish the job a second time.
+    assert database.save_result("job1", "c", None, "failed") == []
+
+
+def test_get_scraped_urls_only_returns_successes(database):
+    database.create_job("job1", total=2, urls=["a", "b"])
+    database.save_results_bulk(
+        [
+            {"job_id": "job1", "url": "a", "data": {}, "status": "success"},
+            {"job_id": "job1", "url": "b", "data": None, "status": "failed"},
+        ]
+    )
+
+    assert database.get_scraped_urls(["a", "b", "c"]) == {"a"}
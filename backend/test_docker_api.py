@@ -0,0 +1,125 @@
+import json
+
+import httpx
+import pytest
+
+from backend import docker_api
+
+
+class FakeEngine:
+    """Minimal Docker Engine API backed by an in-memory container list."""
+
+    def __init__(self, containers):
+        self.containers = containers
+        self.requests = []
+
+    def _find(self, container_id):
+        return next(c for c in self.containers if c["Id"] == container_id)
+
+    def __call__(self, request):
+        path = request.url.path
+        self.requests.append((request.method, path))
+        if path == "/containers/json":
+            labels = json.loads(request.url.params["filters"])["label"]
+            self.labels = labels
+            return httpx.Response(200, json=self.containers)
+        if path == "/containers/create":
+            body = json.loads(request.content)
+            container = {
+                "Id": f"id-{len(self.containers) + 1}",
+                "Name": "/" + request.url.params["name"],
+                "State": "running",
+                "Labels": body["Labels"],
+            }
+            self.containers.append(container)
+            return httpx.Response(201, json={"Id": container["Id"]})
+        container_id, action = path.split("/")[2:4]
+        container = self._find(container_id)
+        if action == "json":
+            return httpx.Response(
+                200,
+                json={
+                    "Name": container["Name"],
+                    "Config": {"Hostname": "abc", "Image": "worker", "Labels": container["Labels"]},
+                    "HostConfig": {},
+                    "NetworkSettings": {"Networks": {"proj_scraper-network": {}}},
+                },
+            )
+        if action == "start":
+            container["State"] = "running"
+            return httpx.Response(204)
+        if action == "stop":
+            container["State"] = "exited"
+            return httpx.Response(204)
+        return httpx.Response(404)
+
+
+def worker(number, state="running"):
+    return {
+        "Id": f"w{number}",
+        "Name": f"/proj-worker-{number}",
+        "State": state,
+        "Labels": {
+            "com.docker.compose.service": "worker",
+            "com.docker.compose.project": "proj",
+            "com.docker.compose.container-number": str(number),
+        },
+    }
+
+
+@pytest.fixture
+def engine(monkeypatch, tmp_path):
+    def install(containers):
+        fake = FakeEngine(containers)
+        socket = tmp_path / "docker.sock"
+        socket.touch()
+        monkeypatch.setattr(docker_api, "DOCKER_SOCKET", str(socket))
+        monkeypatch.setattr(docker_api, "COMPOSE_PROJECT", "proj")
+        client = httpx.Client(transport=httpx.MockTransport(fake), base_url="http://docker")
+        monkeypatch.setattr(docker_api, "_client", client)
+        return fake
+
+    return install
+
+
+def test_scale_up_clones_numbered_replicas(engine):
+    fake = engine([worker(1)])
+    assert docker_api.scale_service("worker", 3)
+    names = [c["Name"] for c in fake.containers]
+    assert names == ["/proj-worker-1", "/proj-worker-2", "/proj-worker-3"]
+    assert [c["Labels"]["com.docker.compose.container-number"] for c in fake.containers] == ["1", "2", "3"]
+    assert "com.docker.compose.project=proj" in fake.labels
+
+
+def test_scale_up_restarts_stopped_replicas_first(engine):
+    fake = engine([worker(1), worker(2, "exited")])
+    assert docker_api.scale_service("worker", 2)
+    assert ("POST", "/containers/w2/start") in fake.requests
+    assert not any(path == "/containers/create" for _, path in fake.requests)
+    assert [c["State"] for c in fake.containers] == ["running", "running"]
+
+
+def test_scale_down_stops_highest_numbered_replicas(engine):
+    fake = engine([worker(1), worker(2), worker(3)])
+    assert docker_api.scale_service("worker", 1)
+    assert [c["State"] for c in fake.containers] == ["running", "exited", "exited"]
+
+
+def test_clone_name_without_trailing_number(engine):
+    template = worker(1)
+    template["Name"] = "/worker"
+    fake = engine([template])
+    assert docker_api.scale_service("worker", 2)
+    assert fake.containers[-1]["Name"] == "/worker-2"
+
+
+def test_scale_service_needs_compose_project(engine, monkeypatch):
+    fake = engine([worker(1), worker(2)])
+    monkeypatch.setattr(docker_api, "COMPOSE_PROJECT", None)
+    assert not docker_api.scale_service("worker", 0)
+    assert fake.requests == []
+
+
+def test_scale_service_falls_back_without_replicas(engine):
+    engine([])
+    assert not docker_api.scale_service("worker", 1)
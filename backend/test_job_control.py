@@ -0,0 +1,51 @@
+import importlib
+import itertools
+
+from fastapi.testclient import TestClient
+
+
+class FakeGroupResult:
+    _ids = itertools.count(1)
+
+    def __init__(self):
+        self.id = f"group{next(self._ids)}"
+
+    def apply_async(self):
+        return self
+
+    def save(self):
+        pass
+
+
+def load_main(monkeypatch, tmp_path):
+    monkeypatch.setenv("SCRAPER_DB", str(tmp_path / "test.db"))
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
+    from backend import database
+    importlib.reload(database)
+    database.init_db()
+    import backend.main as main
+    importlib.reload(main)
+    monkeypatch.setattr(main, "group", lambda tasks: FakeGroupResult())
+    monkeypatch.setattr(main, "schedule_worker_scaling", lambda: None)
+    revoked = []
+    monkeypatch.setattr(main, "_revoke_group", revoked.append)
+    return main, database, revoked
+
+
+def test_pause_and_stop_revoke_every_domain_group(monkeypatch, tmp_path):
+    main, database, revoked = load_main(monkeypatch, tmp_path)
+    database.create_job("job1", total=4, urls=["a1", "a2", "b1", "b2"])
+    # One group per discovered domain.
+    first = main._launch_batches("job1", ["a1", "a2"])
+    second = main._launch_batches("job1", ["b1", "b2"])
+    client = TestClient(main.app)
+
+    assert client.post("/scrape/pause/job1").json()["status"] == "paused"
+    assert revoked == [first, second]
+
+    assert client.post("/scrape/resume/job1").json()["status"] == "resumed"
+    revoked.clear()
+    assert client.post("/scrape/stop/job1").json()["status"] == "cancelled"
+    # Only the group launched on resume is still pending revocation.
+    assert len(revoked) == 1 and revoked[0] not in (first, second)
+    assert database.pop_job_groups("job1") == []
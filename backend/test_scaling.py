@@ -1,25 +1,54 @@
-import os
 import importlib
 
+import pytest
 
-def test_scale_worker_containers(monkeypatch, tmp_path):
-    os.environ["SCRAPER_DB"] = str(tmp_path / "test.db")
-    os.environ.setdefault("OPENAI_API_KEY", "test")
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+        self.ttls = {}
+
+    def get(self, key):
+        value = self.values.get(key)
+        return str(value).encode() if value is not None else None
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+        self.ttls[key] = ex
+
+    def expire_all(self):
+        self.values.clear()
+
+
+@pytest.fixture
+def scaling(monkeypatch, tmp_path):
+    monkeypatch.setenv("SCRAPER_DB", str(tmp_path / "test.db"))
+    monkeypatch.setenv("OPENAI_API_KEY", "test")
     from backend import database
     importlib.reload(database)
     database.init_db()
     import backend.main as main
     importlib.reload(main)
 
-    database.create_job("job1", total=1, urls=["u"], status="RUNNING")
-    database.create_job("job2", total=1, urls=["u"], status="PENDING")
-
     calls = []
 
     def fake_run(cmd, check):
         calls.append(cmd)
 
+    redis = FakeRedis()
     monkeypatch.setattr(main.subprocess, "run", fake_run)
+    monkeypatch.setattr(main.docker_api, "scale_service", lambda service, target: False)
+    monkeypatch.setattr(main.celery_app.backend, "client", redis, raising=False)
+    yield main, database, calls, redis
+    monkeypatch.undo()
+    importlib.reload(database)
+
+
+def test_scale_worker_containers(scaling):
+    main, database, calls, redis = scaling
+    database.create_job("job1", total=1, urls=["u"], status="RUNNING")
+    database.create_job("job2", total=1, urls=["u"], status="PENDING")
+
     main.scale_worker_containers()
     assert calls[-1][4] == "worker=2"
 
@@ -27,3 +56,22 @@ def test_scale_worker_containers(monkeypatch, tmp_path):
     database.update_job_status("job2", "COMPLETED")
     main.scale_worker_containers()
     assert calls[-1][4] == "worker=0"
+
+
+def test_scaling_skipped_until_target_expires(scaling):
+    main, database, calls, redis = scaling
+    database.create_job("job1", total=1, urls=["u"], status="RUNNING")
+
+    main.scale_worker_containers()
+    assert len(calls) == 1
+    assert redis.ttls[main.SCALE_TARGET_KEY] == main.SCALE_TARGET_TTL
+
+    # Mismo objetivo que el último aplicado: no se llama a Docker.
+    main.scale_worker_containers()
+    assert len(calls) == 1
+
+    # Al caducar la clave se vuelve a aplicar.
+    redis.expire_all()
+    main.scale_worker_containers()
+    assert len(calls) == 2
+    assert calls[-1][4] == "worker=1"
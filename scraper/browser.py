@@ -1,16 +1,25 @@
 import asyncio
+import itertools
 import logging
 import os
 import random
-from typing import List
+import re
+from types import MappingProxyType
+from typing import Iterator, List, Mapping
+from urllib.parse import urlparse
 
 import httpx
+import lxml.html
+from lxml import etree
 from playwright.async_api import (
     BrowserContext,
     Page,
+    Route,
     TimeoutError as PWTimeout,
 )
 
+from .extractor import _DROP_TAGS
+
 # --- Configuración --- (Eventualmente mover a un archivo de config central)
 PAGE_TIMEOUT_MS = int(os.getenv("PAGE_TIMEOUT_MS", "30000"))  # 30 segundos por defecto
 MAX_FETCH_RETRY = 3
@@ -30,12 +39,90 @@ USER_AGENTS: List[str] = [
 
 # Cabecera por defecto utilizada como base (se actualiza dinámicamente en cada petición)
 HEADERS = {"User-Agent": USER_AGENTS[0]}
+# Rotación de user agents; se crea en el primer uso (tras el fork del worker)
+# para que cada proceso la recorra en un orden aleatorio distinto.
+_ua_cycle: Iterator[str] | None = None
+# Cabeceras precalculadas (una por user agent) para no crear un dict por petición.
+_HEADER_POOL = tuple(MappingProxyType({"User-Agent": ua}) for ua in USER_AGENTS)
+# Cabeceras asignadas a cada host; se vacía al superar ``_MAX_HOSTS`` entradas.
+_host_headers: dict[str, Mapping[str, str]] = {}
+_MAX_HOSTS = 10_000
+
+# Ruta rápida sin navegador: muchas fichas de producto se renderizan en el
+# servidor y basta un GET. Se desactiva con ``STATIC_FETCH=0``.
+STATIC_FETCH = os.getenv("STATIC_FETCH", "1") == "1"
+STATIC_FETCH_TIMEOUT = 10
+# Texto visible mínimo para considerar que la página no depende de JavaScript.
+# Se mide sin cabecera, menú ni pie, que un shell de JavaScript también trae.
+STATIC_MIN_TEXT_CHARS = 500
+# Dominios cuyo porcentaje de aciertos cae por debajo de este valor (tras un
+# mínimo de intentos) van directamente a Playwright.
+STATIC_MIN_HIT_RATE = 0.2
+STATIC_MIN_SAMPLES = 10
+
+# Aciertos e intentos de la ruta rápida por dominio: ``{netloc: [hits, tries]}``.
+_static_stats: dict[str, list[int]] = {}
+
+# Cliente HTTP compartido por la ruta rápida, el fallback de Playwright y el
+# crawler: mantiene las conexiones TCP/TLS abiertas entre peticiones.
+HTTP_LIMITS = httpx.Limits(max_connections=200, max_keepalive_connections=100)
+try:  # HTTP/2 requiere el extra ``httpx[http2]``
+    import h2  # noqa: F401
+
+    HTTP2 = True
+except ImportError:
+    HTTP2 = False
+_http_client: httpx.AsyncClient | None = None
+
+
+# Tipos de recurso que no aportan nada a la extracción y se bloquean.
+_BLOCKED_RESOURCES = frozenset({"image", "stylesheet", "font", "media"})
+
+# Selectores genéricos de botones de banners de cookies. Se unen en una lista
+# CSS filtrada a elementos visibles para resolverlos con una sola consulta.
+_COOKIE_SELECTORS = [
+    '[id*="cookie"] a',
+    '[class*="cookie"] a',
+    '[id*="banner"] button',
+    '[class*="banner"] button',
+    'button:has-text("Accept")',
+    'button:has-text("Aceptar")',
+    'button:has-text("OK")',
+]
+_COOKIE_BUTTON = ", ".join(_COOKIE_SELECTORS) + " >> visible=true"
+# Marcas de las plataformas de consentimiento y de los banners de cookies más
+# comunes. Palabras sueltas como "privacidad" o "aceptar" salen en casi
+# cualquier pie de página, así que no sirven para descartar la búsqueda.
+_BANNER_WORDS = re.compile(
+    r"onetrust|cookiebot|didomi|usercentrics|quantcast|trustarc|cookieyes"
+    r"|cookie[-_ ]?(?:consent|banner|notice|bar|law|policy|popup)"
+    r"|cc[-_](?:banner|window)|gdpr",
+    re.I,
+)
 
 
 def get_random_user_agent() -> str:
-    """Devuelve un user agent aleatorio."""
+    """Devuelve el siguiente user agent de la rotación."""
+
+    global _ua_cycle
+    if _ua_cycle is None:
+        _ua_cycle = itertools.cycle(random.sample(USER_AGENTS, len(USER_AGENTS)))
+    return next(_ua_cycle)
+
 
-    return random.choice(USER_AGENTS)
+def get_headers_for_host(host: str) -> Mapping[str, str]:
+    """Devuelve las cabeceras HTTP para ``host``.
+
+    El user agent se sortea la primera vez y se mantiene para ese host, de modo
+    que todas sus peticiones (y reintentos) presentan el mismo navegador.
+    """
+
+    headers = _host_headers.get(host)
+    if headers is None:
+        if len(_host_headers) >= _MAX_HOSTS:
+            _host_headers.clear()
+        headers = _host_headers[host] = random.choice(_HEADER_POOL)
+    return headers
 
 
 async def create_context(browser, *, proxy: str | None = None) -> BrowserContext:
@@ -49,9 +136,100 @@ async def create_context(browser, *, proxy: str | None = None) -> BrowserContext
     await context.add_init_script(
         "Object.defineProperty(navigator, 'webdriver', {get: () => undefined})"
     )
+    # Se registra una vez por contexto y vale para todas sus páginas y reintentos.
+    await context.route("**/*", _block_heavy_resources)
     return context
 
 
+def _block_heavy_resources(route: Route):
+    """Aborta imágenes, hojas de estilo, fuentes y multimedia; deja pasar el resto."""
+
+    if route.request.resource_type in _BLOCKED_RESOURCES:
+        return route.abort()
+    return route.continue_()
+
+
+def looks_server_rendered(html: str) -> bool:
+    """Indica si ``html`` ya trae el contenido sin necesidad de ejecutar JavaScript."""
+
+    try:
+        doc = lxml.html.fromstring(html)
+    except (etree.ParserError, ValueError):
+        return False
+    if doc.xpath('//script[@type="application/ld+json"][contains(., "Product")]'):
+        return True
+    etree.strip_elements(doc, *_DROP_TAGS, "template", with_tail=False)
+    body = doc.find("body")
+    text = body.text_content() if body is not None else ""
+    return len(" ".join(text.split())) >= STATIC_MIN_TEXT_CHARS
+
+
+def _static_fetch_enabled(netloc: str) -> bool:
+    hits, tries = _static_stats.get(netloc, (0, 0))
+    return tries < STATIC_MIN_SAMPLES or hits / tries >= STATIC_MIN_HIT_RATE
+
+
+async def fetch_static_html(url: str) -> str | None:
+    """Intenta obtener ``url`` con un GET simple, sin lanzar un contexto de navegador.
+
+    Devuelve ``None`` si la petición falla o si la página parece renderizarse
+    en el cliente, en cuyo caso debe usarse :func:`get_html_from_url`.
+    """
+
+    netloc = urlparse(url).netloc
+    if not STATIC_FETCH or not _static_fetch_enabled(netloc):
+        return None
+
+    html = None
+    try:
+        resp = await get_http_client().get(
+            url, headers=get_headers_for_host(netloc), timeout=STATIC_FETCH_TIMEOUT
+        )
+        resp.raise_for_status()
+        if "html" in resp.headers.get("content-type", "html"):
+            html = resp.text
+    except Exception as exc:
+        logging.info(f"[Browser] Ruta rápida fallida para {url}: {exc}")
+
+    ok = bool(html) and looks_server_rendered(html)
+    stats = _static_stats.setdefault(netloc, [0, 0])
+    stats[0] += ok
+    stats[1] += 1
+    return html if ok else None
+
+
+def record_static_miss(url: str) -> None:
+    """Descuenta el acierto de la ruta rápida para ``url``.
+
+    Se usa cuando el HTML estático pasó el filtro pero no sirvió para extraer
+    el producto y hubo que recurrir a Playwright.
+    """
+
+    stats = _static_stats.get(urlparse(url).netloc)
+    if stats and stats[0]:
+        stats[0] -= 1
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """Devuelve el cliente HTTP compartido del proceso, creándolo si hace falta."""
+
+    global _http_client
+    if _http_client is None or _http_client.is_closed:
+        _http_client = httpx.AsyncClient(
+            http2=HTTP2, limits=HTTP_LIMITS, follow_redirects=True
+        )
+    return _http_client
+
+
+async def close_http_client() -> None:
+    """Cierra el cliente HTTP compartido."""
+
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
 async def get_html_from_url(context: BrowserContext, url: str) -> str | None:
     """Obtiene el HTML de ``url`` usando Playwright y hace fallback a HTTP puro si falla."""
 
@@ -59,21 +237,16 @@ async def get_html_from_url(context: BrowserContext, url: str) -> str | None:
     for attempt in range(MAX_FETCH_RETRY):
         try:
             page = await context.new_page()
-            await page.route(
-                "**/*",
-                lambda route: route.abort()
-                if route.request.resource_type in ["image", "stylesheet", "font", "media"]
-                else route.continue_(),
-            )
-
             await page.goto(url, timeout=PAGE_TIMEOUT_MS, wait_until="domcontentloaded")
             await page.wait_for_load_state("networkidle", timeout=15000)
 
             # Retardo aleatorio para simular navegación humana
             await asyncio.sleep(random.uniform(*DELAY_RANGE))
 
-            await _handle_cookie_banners(page)
-            return await page.content()
+            html = await page.content()
+            if await _handle_cookie_banners(page, html):
+                html = await page.content()
+            return html
 
         except PWTimeout:
             logging.warning(
@@ -95,41 +268,36 @@ async def get_html_from_url(context: BrowserContext, url: str) -> str | None:
 
     # Fallback usando httpx, útil cuando Playwright es bloqueado.
     try:
-        async with httpx.AsyncClient(
+        resp = await get_http_client().get(
+            url,
+            headers=get_headers_for_host(urlparse(url).netloc),
             timeout=PAGE_TIMEOUT_MS / 1000,
-            headers={"User-Agent": get_random_user_agent()},
-            follow_redirects=True,
-        ) as client:
-            resp = await client.get(url)
-            resp.raise_for_status()
-            return resp.text
+        )
+        resp.raise_for_status()
+        return resp.text
     except Exception as exc:
         logging.error(f"[Browser] Fallback HTTP request failed for {url}: {exc}")
         return None
 
 
-async def _handle_cookie_banners(page: Page):
-    """Intenta detectar y cerrar banners de cookies de forma genérica."""
+async def _handle_cookie_banners(page: Page, html: str) -> bool:
+    """Intenta detectar y cerrar banners de cookies de forma genérica.
 
-    cookie_selectors = [
-        '[id*="cookie"] a',
-        '[class*="cookie"] a',
-        '[id*="banner"] button',
-        '[class*="banner"] button',
-        'button:has-text("Accept")',
-        'button:has-text("Aceptar")',
-        'button:has-text("OK")',
-    ]
-    for selector in cookie_selectors:
-        try:
-            button = page.locator(selector).first
-            if await button.is_visible(timeout=500):
-                await button.click(timeout=1000)
-                logging.info(
-                    f"[Browser] Banner de cookies cerrado con el selector: {selector}"
-                )
-                await asyncio.sleep(0.5)
-                return
-        except Exception:
-            # Es normal que muchos selectores fallen
-            pass
+    ``html`` es el contenido actual de la página: si no menciona cookies ni
+    consentimiento no se consulta el DOM. Devuelve ``True`` si se cerró un banner.
+    """
+
+    if not _BANNER_WORDS.search(html):
+        return False
+    try:
+        # Una sola consulta al driver en lugar de una por selector.
+        button = page.locator(_COOKIE_BUTTON).first
+        if await button.count():
+            await button.click(timeout=1000)
+            logging.info("[Browser] Banner de cookies cerrado")
+            await asyncio.sleep(0.5)
+            return True
+    except Exception:
+        # Es normal que el botón desaparezca o quede tapado antes del clic
+        pass
+    return False
@@ -0,0 +1,214 @@
+import asyncio
+import logging
+import os
+import socket
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable
+from urllib.parse import urlsplit
+
+from playwright.async_api import Browser, BrowserContext, Playwright, async_playwright
+
+# --- Configuración ---
+# Navegadores Chromium que mantiene vivos cada proceso de worker.
+POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", "1"))
+# Tras este número de contextos el navegador se cierra y se lanza uno nuevo,
+# para acotar las fugas de memoria de procesos Chromium de larga duración.
+RECYCLE_AFTER = int(os.getenv("BROWSER_POOL_RECYCLE_AFTER", "100"))
+# Contextos que un mismo navegador atiende a la vez; por defecto tantos como
+# URLs procesa en paralelo un lote (``URL_CONCURRENCY``).
+MAX_CONTEXTS = int(os.getenv("BROWSER_MAX_CONTEXTS", os.getenv("URL_CONCURRENCY", "5")))
+# Páginas que atiende un mismo ``BrowserContext`` antes de cerrarlo y crear otro
+# limpio (cookies, caché, almacenamiento). ``1`` equivale a un contexto por URL.
+CONTEXT_RECYCLE_AFTER = int(os.getenv("BROWSER_CONTEXT_RECYCLE_AFTER", "20"))
+# Con ``USE_CDP=1`` los workers no lanzan Chromium: se conectan por CDP al
+# navegador compartido del servicio ``chromium`` y solo abren contextos en él.
+USE_CDP = os.getenv("USE_CDP", "0") == "1"
+CDP_ENDPOINT = os.getenv("CDP_ENDPOINT", "http://chromium:9222")
+
+
+async def _resolve_cdp_endpoint(endpoint: str) -> str:
+    """Sustituye el nombre del host por su IP.
+
+    Chromium rechaza las peticiones a ``/json/version`` cuya cabecera ``Host``
+    no es una IP ni ``localhost``, y ese es el nombre del servicio en Docker.
+    """
+    parts = urlsplit(endpoint)
+    if not parts.hostname:
+        return endpoint
+    try:
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            parts.hostname, parts.port, family=socket.AF_INET
+        )
+    except OSError:
+        return endpoint
+    ip = infos[0][4][0]
+    netloc = f"{ip}:{parts.port}" if parts.port else ip
+    return parts._replace(netloc=netloc).geturl()
+
+
+class BrowserPool:
+    """Pool de navegadores Chromium persistentes de un proceso de worker.
+
+    Los navegadores se lanzan una sola vez (en ``warmup`` o bajo demanda) y se
+    reutilizan entre tareas; por URL solo se crea un ``BrowserContext``. Cada
+    navegador se presta a la vez a un máximo de ``max_leases`` llamadas y se
+    recicla tras ``recycle_after`` usos o si se desconecta; se cierra cuando
+    termina su último préstamo. Si se indica ``cdp_endpoint``, los
+    "navegadores" del pool son conexiones CDP a un Chromium compartido en lugar
+    de procesos propios.
+
+    Con :meth:`context` cada navegador conserva además los contextos libres,
+    que se reutilizan durante ``context_recycle_after`` páginas.
+    """
+
+    def __init__(
+        self,
+        size: int = POOL_SIZE,
+        recycle_after: int = RECYCLE_AFTER,
+        cdp_endpoint: str | None = CDP_ENDPOINT if USE_CDP else None,
+        context_recycle_after: int = CONTEXT_RECYCLE_AFTER,
+        max_leases: int = MAX_CONTEXTS,
+    ):
+        self.size = max(1, size)
+        self.recycle_after = recycle_after
+        self.cdp_endpoint = cdp_endpoint
+        self.context_recycle_after = max(1, context_recycle_after)
+        self.max_leases = max(1, max_leases)
+        # Contextos libres de cada navegador y páginas que lleva atendidas cada uno.
+        self._contexts: dict[Browser, list[tuple[BrowserContext, int]]] = {}
+        self._playwright: Playwright | None = None
+        # Un elemento por préstamo disponible; ``None`` avisa de que ha quedado
+        # un hueco libre para lanzar otro navegador.
+        self._idle: asyncio.Queue[Browser | None] = asyncio.Queue()
+        self._uses: dict[Browser, int] = {}
+        self._active: dict[Browser, int] = {}
+        self._lock = asyncio.Lock()
+        self._retiring: set[asyncio.Task] = set()
+
+    async def _launch(self) -> Browser:
+        if self._playwright is None:
+            self._playwright = await async_playwright().start()
+        if self.cdp_endpoint:
+            # ``close`` sobre esta conexión solo desconecta; el navegador remoto sigue vivo.
+            endpoint = await _resolve_cdp_endpoint(self.cdp_endpoint)
+            browser = await self._playwright.chromium.connect_over_cdp(endpoint)
+        else:
+            browser = await self._playwright.chromium.launch(headless=True)
+        self._uses[browser] = 0
+        return browser
+
+    def _add(self, browser: Browser) -> None:
+        for _ in range(self.max_leases):
+            self._idle.put_nowait(browser)
+
+    async def warmup(self, size: int | None = None) -> None:
+        """Lanza navegadores hasta tener ``size`` (por defecto ``self.size``)."""
+        if size is not None:
+            self.size = max(1, size)
+        async with self._lock:
+            while len(self._uses) < self.size:
+                self._add(await self._launch())
+
+    async def acquire(self) -> Browser:
+        """Presta un navegador con préstamos libres, lanzándolo si el pool no está lleno."""
+        while True:
+            async with self._lock:
+                if self._idle.empty() and len(self._uses) < self.size:
+                    self._add(await self._launch())
+            browser = await self._idle.get()
+            if browser is None or browser not in self._uses:
+                continue  # aviso de hueco libre o préstamo de un navegador retirado
+            if browser.is_connected():
+                self._uses[browser] += 1
+                self._active[browser] = self._active.get(browser, 0) + 1
+                return browser
+            # Chromium murió mientras estaba libre: se reemplaza.
+            self._retire(browser)
+
+    def release(self, browser: Browser) -> None:
+        """Devuelve el préstamo de ``browser`` o lo recicla si ya se ha usado bastante."""
+        self._active[browser] = self._active.get(browser, 1) - 1
+        if (
+            browser in self._uses
+            and browser.is_connected()
+            and self._uses[browser] < self.recycle_after
+        ):
+            self._idle.put_nowait(browser)
+            return
+        self._retire(browser)
+
+    def _retire(self, browser: Browser) -> None:
+        """Saca ``browser`` del pool y lo cierra cuando ya no tiene préstamos."""
+        if self._uses.pop(browser, None) is not None:
+            # El hueco queda libre y el próximo ``acquire`` lanzará un reemplazo.
+            self._idle.put_nowait(None)
+        if self._active.get(browser, 0) > 0:
+            return
+        self._active.pop(browser, None)
+        self._contexts.pop(browser, None)
+        task = asyncio.get_running_loop().create_task(self._close_quietly(browser))
+        self._retiring.add(task)
+        task.add_done_callback(self._retiring.discard)
+
+    @asynccontextmanager
+    async def context(
+        self, factory: Callable[[Browser], Awaitable[BrowserContext]]
+    ) -> AsyncIterator[BrowserContext]:
+        """Presta un contexto de navegador, creándolo con ``factory`` si hace falta.
+
+        El contexto vuelve al pool al salir del bloque; se cierra si ya ha
+        atendido ``context_recycle_after`` páginas o si el bloque lanzó una
+        excepción.
+        """
+        browser = await self.acquire()
+        try:
+            free = self._contexts.get(browser)
+            if free:
+                context, pages = free.pop()
+                if not free:
+                    del self._contexts[browser]
+            else:
+                context, pages = await factory(browser), 0
+            try:
+                yield context
+            except BaseException:
+                await self._close_quietly(context)
+                raise
+            if (
+                pages + 1 < self.context_recycle_after
+                and browser.is_connected()
+                and browser in self._uses
+            ):
+                self._contexts.setdefault(browser, []).append((context, pages + 1))
+            else:
+                await self._close_quietly(context)
+        finally:
+            self.release(browser)
+
+    @staticmethod
+    async def _close_quietly(target: Browser | BrowserContext) -> None:
+        try:
+            await target.close()
+        except Exception as exc:  # pragma: no cover - best effort
+            logging.warning(f"[BrowserPool] No se pudo cerrar un navegador o contexto: {exc}")
+
+    async def close(self) -> None:
+        """Cierra todos los navegadores y detiene Playwright."""
+        if self._retiring:
+            await asyncio.gather(*self._retiring, return_exceptions=True)
+        for free in self._contexts.values():
+            for context, _ in free:
+                await self._close_quietly(context)
+        self._contexts.clear()
+        for browser in list(self._uses):
+            await self._close_quietly(browser)
+        self._uses.clear()
+        self._active.clear()
+        self._idle = asyncio.Queue()
+        if self._playwright is not None:
+            await self._playwright.stop()
+            self._playwright = None
+
+
+# Pool compartido por las tareas de un mismo proceso de worker.
+pool = BrowserPool()
@@ -1,35 +1,68 @@
 import asyncio
+import hashlib
+import io
 import logging
-import gzip
+import os
 import re
+import time
 from urllib.parse import urljoin, urlparse
-from collections import deque
 
 import httpx
-from bs4 import BeautifulSoup
-from .browser import get_random_user_agent
+import lxml.html
+import redis
+import zstandard
+from lxml import etree
+from .browser import get_headers_for_host, get_http_client
+
+try:  # ISA-L descomprime gzip bastante más rápido; es opcional
+    from isal import igzip as gzip
+except ImportError:  # pragma: no cover - depende del entorno
+    import gzip
 
 # --- Configuración ---
 MAX_PAGES_CRAWL = 500  # Límite para el rastreo manual
+CRAWL_CONCURRENCY = 16  # Descargas simultáneas durante el rastreo manual
+# URLs pendientes como máximo en la cola del rastreo. Los enlaces que llegan con
+# la cola llena no se marcan como vistos y pueden volver a encolarse más tarde.
+MAX_CRAWL_FRONTIER = 2 * MAX_PAGES_CRAWL
 REQUEST_TIMEOUT = 15
 SITEMAP_PATHS = ["/sitemap.xml", "/sitemap_index.xml", "/sitemap.xml.gz", "/wp-sitemap.xml"]
+SITEMAP_CONCURRENCY = 16  # Descargas simultáneas de sitemaps por dominio
+
+# Caché en Redis de sitemaps y robots.txt (ya descomprimidos), compartida por
+# todos los workers. ``SITEMAP_CACHE_TTL=0`` la desactiva.
+SITEMAP_CACHE_URL = os.getenv("SITEMAP_CACHE_URL", "redis://redis:6379/1")
+SITEMAP_CACHE_TTL = int(os.getenv("SITEMAP_CACHE_TTL", "3600"))
+SITEMAP_CACHE_MAX_BYTES = 16 * 1024 * 1024  # Tamaño máximo comprimido por entrada
+# Tras un fallo de conexión no se vuelve a intentar durante este intervalo.
+SITEMAP_CACHE_RETRY_AFTER = 30
 
 # Expresiones regulares para filtrar URLs (simplificado)
 _EXCLUDE_EXT = re.compile(r"\.(?:png|jpe?g|gif|webp|avif|bmp|svg|css|js|pdf|zip|gz)$", re.I)
 _PRODUCT_RX = re.compile(r"/(?:p|product|producto|item|dp)/", re.I)
 
 
-async def _fetch_url(client: httpx.AsyncClient, url: str, max_retries: int = 3) -> str | bytes | None:
-    """Descarga ``url`` con reintentos y rotación de User-Agent."""
+async def _fetch_url(
+    client: httpx.AsyncClient, url: str, max_retries: int = 3, as_bytes: bool = False
+) -> str | bytes | None:
+    """Descarga ``url`` con reintentos y el User-Agent asignado a su host.
+
+    Con ``as_bytes`` se devuelve el cuerpo sin decodificar, para que el parser
+    XML respete la codificación declarada en el propio documento.
+    """
 
+    headers = get_headers_for_host(urlparse(url).netloc)
     for attempt in range(max_retries):
-        headers = {"User-Agent": get_random_user_agent()}
         try:
-            response = await client.get(url, headers=headers, follow_redirects=True)
+            response = await client.get(
+                url, headers=headers, follow_redirects=True, timeout=REQUEST_TIMEOUT
+            )
             response.raise_for_status()
-            if url.endswith(".gz"):
-                return gzip.decompress(response.content)
-            return response.text
+            # httpx ya decodifica ``Content-Encoding: gzip``; solo se descomprime
+            # si el cuerpo sigue siendo gzip, y fuera del bucle de eventos.
+            if url.endswith(".gz") and response.content[:2] == b"\x1f\x8b":
+                return await asyncio.to_thread(gzip.decompress, response.content)
+            return response.content if as_bytes else response.text
         except httpx.HTTPStatusError as e:
             logging.warning(
                 f"[Crawler] Error HTTP {e.response.status_code} al buscar {url} (intento {attempt + 1})"
@@ -48,111 +81,231 @@ async def _fetch_url(client: httpx.AsyncClient, url: str, max_retries: int = 3)
     return None
 
 
+_cache_client: redis.Redis | None = None
+_cache_unavailable_until = 0.0
+
+
+def _cache_key(url: str) -> str:
+    return "sitemap:" + hashlib.sha1(url.encode()).hexdigest()
+
+
+def _get_cache_client() -> redis.Redis | None:
+    global _cache_client
+    if SITEMAP_CACHE_TTL <= 0 or time.monotonic() < _cache_unavailable_until:
+        return None
+    if _cache_client is None:
+        _cache_client = redis.Redis.from_url(
+            SITEMAP_CACHE_URL, socket_connect_timeout=1, socket_timeout=1
+        )
+    return _cache_client
+
+
+def _cache_unavailable(exc: Exception) -> None:
+    global _cache_unavailable_until
+    _cache_unavailable_until = time.monotonic() + SITEMAP_CACHE_RETRY_AFTER
+    logging.warning(f"[Crawler] Caché de sitemaps no disponible: {exc}")
+
+
+async def _fetch_cached(client: httpx.AsyncClient, url: str) -> bytes | None:
+    """Como ``_fetch_url(..., as_bytes=True)`` pero pasando por la caché de sitemaps.
+
+    El cliente de Redis es síncrono: sus llamadas (y la compresión) se hacen en
+    un hilo para no bloquear el bucle de eventos, ni siquiera durante el
+    timeout de conexión cuando Redis está caído.
+    """
+
+    cache = _get_cache_client()
+    if cache is not None:
+        try:
+            cached = await asyncio.to_thread(cache.get, _cache_key(url))
+        except redis.RedisError as exc:
+            _cache_unavailable(exc)
+            cache = None
+        else:
+            if cached is not None:
+                return await asyncio.to_thread(zstandard.decompress, cached)
+
+    content = await _fetch_url(client, url, as_bytes=True)
+    if content and cache is not None:
+        compressed = await asyncio.to_thread(zstandard.compress, content)
+        if len(compressed) <= SITEMAP_CACHE_MAX_BYTES:
+            try:
+                await asyncio.to_thread(
+                    cache.set, _cache_key(url), compressed, ex=SITEMAP_CACHE_TTL
+                )
+            except redis.RedisError as exc:
+                _cache_unavailable(exc)
+    return content
+
+
 async def _discover_sitemaps_from_robots(client: httpx.AsyncClient, base_url: str) -> list[str]:
     """Lee ``robots.txt`` y extrae entradas ``Sitemap`` si existen."""
 
     robots_url = urljoin(base_url, "robots.txt")
-    content = await _fetch_url(client, robots_url)
+    content = await _fetch_cached(client, robots_url)
     if not content:
         return []
     sitemap_urls = []
-    for line in content.splitlines():
+    for line in content.decode("utf-8", "replace").splitlines():
         if line.lower().startswith("sitemap:"):
             sitemap_urls.append(line.split(":", 1)[1].strip())
     return sitemap_urls
 
 
-def _parse_sitemap(sitemap_content: str) -> list[str]:
-    """Parsea el contenido de un sitemap (XML) y extrae las URLs."""
+def _parse_sitemap(sitemap_content: bytes) -> tuple[bool, list[str]]:
+    """Parsea el contenido de un sitemap (XML) y devuelve ``(es_indice, urls)``.
+
+    El XML se recorre en streaming con ``iterparse`` en lugar de construir el
+    árbol completo; ``es_indice`` indica si es un sitemap de sitemaps.
+    """
 
+    is_index = False
     urls = []
-    soup = BeautifulSoup(sitemap_content, "xml")
-    for loc in soup.find_all("loc"):
-        urls.append(loc.text.strip())
-    return urls
+    try:
+        for _, element in etree.iterparse(
+            io.BytesIO(sitemap_content),
+            events=("end",),
+            recover=True,
+            # XML remoto: sin entidades externas ni accesos a red.
+            resolve_entities=False,
+            no_network=True,
+        ):
+            if not isinstance(element.tag, str):
+                continue
+            name = element.tag.rsplit("}", 1)[-1]
+            if name == "loc" and element.text:
+                urls.append(element.text.strip())
+            elif name == "sitemap":
+                is_index = True
+            element.clear()
+    except etree.LxmlError as exc:
+        logging.warning(f"[Crawler] Sitemap no válido: {exc}")
+    return is_index, urls
+
+
+def _extract_links(html: bytes) -> list[str]:
+    """Devuelve los ``href`` de todos los enlaces ``<a>`` de ``html``."""
+
+    try:
+        tree = lxml.html.fromstring(html)
+    except (etree.ParserError, ValueError):
+        return []
+    return tree.xpath("//a/@href")
 
 
 async def find_urls_via_sitemap(domain: str) -> list[str] | None:
     """Intenta encontrar y parsear sitemaps para un dominio."""
 
     base_url = urljoin(domain, "/")
-    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT) as client:
-        candidates = [urljoin(base_url, p) for p in SITEMAP_PATHS]
-        candidates.extend(await _discover_sitemaps_from_robots(client, base_url))
+    client = get_http_client()
+    semaphore = asyncio.Semaphore(SITEMAP_CONCURRENCY)
+    requested: set[str] = set()
 
-        all_urls: list[str] = []
-        for sitemap_url in candidates:
+    async def fetch(sitemap_url: str) -> bytes | None:
+        async with semaphore:
             logging.info(f"[Crawler] Buscando sitemap en: {sitemap_url}")
-            content = await _fetch_url(client, sitemap_url)
-            if not content:
-                continue
-            sitemap_urls = _parse_sitemap(content)
-
-            # Si es un sitemap de sitemaps, explorarlos recursivamente
-            nested = [u for u in sitemap_urls if "sitemap" in u]
-            if nested:
-                nested_contents = await asyncio.gather(
-                    *[_fetch_url(client, u) for u in nested]
-                )
-                for sitemap_content in nested_contents:
-                    if sitemap_content:
-                        sitemap_urls.extend(_parse_sitemap(sitemap_content))
+            return await _fetch_cached(client, sitemap_url)
+
+    async def fetch_all(sitemap_urls: list[str]) -> list[bytes | None]:
+        # Cada sitemap se descarga una sola vez aunque lo listen varias fuentes
+        pending = [u for u in dict.fromkeys(sitemap_urls) if u not in requested]
+        requested.update(pending)
+        return await asyncio.gather(*[fetch(u) for u in pending])
+
+    # Las rutas conocidas y robots.txt se consultan a la vez
+    from_robots, contents = await asyncio.gather(
+        _discover_sitemaps_from_robots(client, base_url),
+        fetch_all([urljoin(base_url, p) for p in SITEMAP_PATHS]),
+    )
+    contents += await fetch_all(from_robots)
 
-            all_urls.extend(sitemap_urls)
+    all_urls: list[str] = []
+    nested: list[str] = []
+    for content in contents:
+        if not content:
+            continue
+        is_index, sitemap_urls = _parse_sitemap(content)
+        # Si es un sitemap de sitemaps, se exploran después los que enumera
+        (nested if is_index else all_urls).extend(sitemap_urls)
 
-        if not all_urls:
-            return None
+    for content in await fetch_all(nested):
+        if content:
+            all_urls.extend(_parse_sitemap(content)[1])
 
-        # Eliminar duplicados conservando orden
-        seen = set()
-        unique_urls = []
-        for u in all_urls:
-            if u not in seen:
-                seen.add(u)
-                unique_urls.append(u)
+    if not all_urls:
+        return None
 
-        product_urls = [u for u in unique_urls if _PRODUCT_RX.search(u)]
-        return product_urls or unique_urls
+    # Eliminar duplicados conservando orden; el filtro de productos se aplica
+    # una sola vez en ``get_urls_for_domain``.
+    return list(dict.fromkeys(all_urls))
 
 
 async def find_urls_via_crawl(domain: str) -> list[str]:
-    """Realiza un rastreo básico del sitio para encontrar URLs."""
+    """Realiza un rastreo básico del sitio para encontrar URLs.
+
+    ``CRAWL_CONCURRENCY`` corrutinas consumen la misma cola, de modo que varias
+    descargas están en curso a la vez en lugar de una por iteración.
+    """
 
     logging.info(
         f"[Crawler] No se encontraron sitemaps, iniciando rastreo manual de {domain}"
     )
-    urls_found = set()
-    queue = deque([urljoin(domain, "/")])
+    start_url = urljoin(domain, "/")
     base_netloc = urlparse(domain).netloc
+    # Captura la URL hasta el primer ``?`` o ``#`` solo si es del mismo host.
+    same_host = re.compile(
+        rf"https?://{re.escape(base_netloc)}(?=[/?#]|$)[^?#]*", re.I
+    )
+    client = get_http_client()
+    urls_found: set[str] = set()
+    enqueued = {start_url}
+    queue: asyncio.Queue[str] = asyncio.Queue()
+    queue.put_nowait(start_url)
+
+    async def worker() -> None:
+        while len(urls_found) < MAX_PAGES_CRAWL:
+            url = await queue.get()
+            try:
+                content = await _fetch_url(client, url, as_bytes=True)
+                if not content or len(urls_found) >= MAX_PAGES_CRAWL:
+                    continue
+
+                urls_found.add(url)
+                logging.info(
+                    f"[Crawler] Rastreado: {url} ({len(urls_found)}/{MAX_PAGES_CRAWL})"
+                )
 
-    async with httpx.AsyncClient(timeout=REQUEST_TIMEOUT) as client:
-        while queue and len(urls_found) < MAX_PAGES_CRAWL:
-            url = queue.popleft()
-            if url in urls_found:
-                continue
-
-            content = await _fetch_url(client, url)
-            if not content:
-                continue
-
-            urls_found.add(url)
-            logging.info(
-                f"[Crawler] Rastreado: {url} ({len(urls_found)}/{MAX_PAGES_CRAWL})"
-            )
-
-            soup = BeautifulSoup(content, "lxml")
-            for link in soup.find_all("a", href=True):
-                href = link["href"]
-                abs_url = urljoin(url, href)
-                # Limpiar fragmentos y parámetros de consulta
-                abs_url = abs_url.split("#")[0].split("?")[0]
-
-                if (
-                    urlparse(abs_url).netloc == base_netloc
-                    and not _EXCLUDE_EXT.search(abs_url)
-                ):
-                    if abs_url not in urls_found and abs_url not in queue:
-                        queue.append(abs_url)
+                for href in _extract_links(content):
+                    try:
+                        abs_url = urljoin(url, href)
+                    except ValueError:
+                        continue
+                    # Mismo host, sin fragmentos ni parámetros de consulta
+                    match = same_host.match(abs_url)
+                    if not match:
+                        continue
+                    abs_url = match.group(0)
+
+                    if (
+                        abs_url not in enqueued
+                        and not _EXCLUDE_EXT.search(abs_url)
+                        and queue.qsize() < MAX_CRAWL_FRONTIER
+                    ):
+                        enqueued.add(abs_url)
+                        queue.put_nowait(abs_url)
+            finally:
+                queue.task_done()
+
+    # El rastreo termina cuando la cola queda vacía sin descargas pendientes o
+    # cuando algún worker alcanza ``MAX_PAGES_CRAWL``.
+    tasks = [asyncio.create_task(worker()) for _ in range(CRAWL_CONCURRENCY)]
+    tasks.append(asyncio.create_task(queue.join()))
+    try:
+        await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+    finally:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
 
     return list(urls_found)
 
@@ -165,7 +318,7 @@ async def get_urls_for_domain(domain: str) -> list[str]:
     if not urls:
         urls = await find_urls_via_crawl(domain)
 
-    product_urls = [u for u in urls if _PRODUCT_RX.search(u)]
+    product_urls = list(filter(_PRODUCT_RX.search, urls))
 
     if product_urls:
         logging.info(
@@ -1,14 +1,19 @@
 import os
+import asyncio
 import logging
 import json
 import re
 from bs4 import BeautifulSoup
+import lxml.html
+from lxml import etree
 from openai import AsyncOpenAI
 import tiktoken
 
 # --- Configuración --- 
 GPT_MODEL = "gpt-4o-mini"
 MAX_CONTENT_TOKENS = 118_000  # Margen de seguridad sobre el límite del modelo
+# Llamadas simultáneas a la API de OpenAI por proceso.
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", "8"))
 
 # Inicializar cliente de OpenAI de forma segura
 # Si la API key no está configurada no inicializamos el cliente para evitar
@@ -23,10 +28,24 @@ if api_key:
 else:
     logging.warning("OPENAI_API_KEY no configurada; la extracción se deshabilitará")
 
+# El semáforo queda ligado al bucle donde se usa; se recrea si el bucle cambia.
+_llm_semaphore: asyncio.Semaphore | None = None
+_llm_semaphore_loop: asyncio.AbstractEventLoop | None = None
+
+
+def _get_llm_semaphore() -> asyncio.Semaphore:
+    global _llm_semaphore, _llm_semaphore_loop
+    loop = asyncio.get_running_loop()
+    if _llm_semaphore is None or _llm_semaphore_loop is not loop:
+        _llm_semaphore = asyncio.Semaphore(LLM_CONCURRENCY)
+        _llm_semaphore_loop = loop
+    return _llm_semaphore
+
 # Inicializar codificador de tokens
+# (se carga una sola vez; sin red ni caché local ``encoding_for_model`` falla)
 try:
     _ENC = tiktoken.encoding_for_model(GPT_MODEL)
-except ImportError:
+except Exception:
     _ENC = None
     logging.warning("tiktoken no disponible; el truncado de texto será aproximado.")
 
@@ -149,12 +168,20 @@ PRODUCT_SCHEMA = {
     }
 }
 
+# Etiquetas que se descartan y etiquetas de las que se toma el texto para el LLM.
+_DROP_TAGS = ("script", "style", "noscript", "header", "footer", "nav")
+_TEXT_TAGS = etree.XPath("//h1|//h2|//h3|//p|//li|//span|//div")
+
 def _truncate_text(text: str, max_tokens: int = MAX_CONTENT_TOKENS) -> str:
     """Recorta el texto para no exceder el límite de tokens del modelo."""
     if not text:
         return ""
+    # Cada token ocupa al menos un byte: si el texto cabe en bytes, cabe en tokens.
+    if len(text) <= max_tokens and len(text.encode("utf-8")) <= max_tokens:
+        return text
     if _ENC:
-        tokens = _ENC.encode(text)
+        # ``encode_ordinary`` no busca tokens especiales (ni falla si aparecen).
+        tokens = _ENC.encode_ordinary(text)
         if len(tokens) > max_tokens:
             return _ENC.decode(tokens[:max_tokens])
     else: # Fallback si tiktoken no está
@@ -165,25 +192,37 @@ def _clean_html_for_llm(html: str) -> str:
     """Convierte HTML a un texto limpio y estructurado para el LLM."""
     if not html:
         return ""
-    soup = BeautifulSoup(html, "lxml")
-    for tag in soup(["script", "style", "noscript", "header", "footer", "nav"]):
-        tag.decompose()
+    try:
+        try:
+            doc = lxml.html.fromstring(html)
+        except ValueError:
+            # lxml no acepta cadenas con declaración de codificación XML
+            doc = lxml.html.fromstring(html.encode("utf-8"))
+    except (etree.ParserError, ValueError):
+        return ""
+    etree.strip_elements(doc, *_DROP_TAGS, with_tail=False)
 
     # Extraer texto de etiquetas importantes
     text_parts = []
-    for tag in soup.find_all(['h1', 'h2', 'h3', 'p', 'li', 'span', 'div']):
-        text = tag.get_text(" ", strip=True)
+    for tag in _TEXT_TAGS(doc):
+        text = " ".join(filter(None, map(str.strip, tag.itertext())))
         if text:
             text_parts.append(text)
-    
+
     return "\n".join(text_parts)
 
-async def extract_product_data_from_html(url: str, html: str) -> dict | None:
+def prepare_text(html: str) -> str:
+    """Devuelve el texto limpio y truncado de ``html`` que se envía al modelo."""
+    return _truncate_text(_clean_html_for_llm(html))
+
+async def extract_product_data_from_html(url: str, html: str, text: str | None = None) -> dict | None:
     """
     Orquesta la extracción de datos de un HTML: limpia, prepara el prompt y llama a GPT.
+
+    ``text`` permite pasar el resultado de :func:`prepare_text` ya calculado,
+    para no volver a limpiar el HTML en cada reintento.
     """
-    cleaned_text = _clean_html_for_llm(html)
-    truncated_text = _truncate_text(cleaned_text)
+    truncated_text = prepare_text(html) if text is None else text
 
     if not truncated_text:
         logging.warning(f"[Extractor] No se pudo extraer contenido procesable de {url}")
@@ -205,12 +244,13 @@ async def extract_product_data_from_html(url: str, html: str) -> dict | None:
         return None
 
     try:  # pragma: no cover - network call
-        response = await client.chat.completions.create(
-            model=GPT_MODEL,
-            messages=messages,
-            temperature=0.2,  # Temperatura baja para mayor consistencia
-            response_format={"type": "json_schema", "json_schema": PRODUCT_SCHEMA},
-        )
+        async with _get_llm_semaphore():
+            response = await client.chat.completions.create(
+                model=GPT_MODEL,
+                messages=messages,
+                temperature=0.2,  # Temperatura baja para mayor consistencia
+                response_format={"type": "json_schema", "json_schema": PRODUCT_SCHEMA},
+            )
         extracted_data = json.loads(response.choices[0].message.content)
         extracted_data['url'] = url  # Añadir la URL original para trazabilidad
         logging.info(f"[Extractor] Datos extraídos exitosamente de {url}")
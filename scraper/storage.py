@@ -1,14 +1,137 @@
 """Helpers for persisting scraped data."""
-from typing import Optional
+import asyncio
+import atexit
+import logging
+import os
+import queue
+import threading
+from typing import List, Optional
+
+import orjson
+
+try:  # pragma: no cover - solo disponible en sistemas POSIX
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
 from backend import database
 
-# Ensure database is initialised when this module is imported
-try:
-    database.init_db()
-except Exception:  # pragma: no cover - best effort
-    pass
+RESULTS_FILE = os.getenv("RESULTS_FILE", "results.jsonl")
+
+
+class JsonlWriter:
+    """Append records to a JSON Lines file from a single background thread.
+
+    Producers only enqueue the record; the writer thread keeps one unbuffered
+    ``O_APPEND`` descriptor open and writes everything queued since its last
+    pass with a single ``os.writev`` call. The write happens under an
+    exclusive ``flock`` because every worker process appends to the same file,
+    so lines from different processes never interleave.
+    """
+
+    # Registros como máximo por llamada a ``writev`` (IOV_MAX en Linux es 1024).
+    MAX_BATCH = 128
+    # Cola acotada: si el disco no da abasto, ``write`` espera (y
+    # ``write_async`` suspende solo a su corrutina) en lugar de acumular
+    # resultados sin límite en memoria.
+    MAX_PENDING = 1024
+
+    def __init__(self, path: str):
+        self.path = path
+        self._queue: queue.Queue = queue.Queue(maxsize=self.MAX_PENDING)
+        self._thread: threading.Thread | None = None
+        self._lock = threading.Lock()
+
+    def write(self, record: dict) -> None:
+        self._ensure_started()
+        self._queue.put(record)
+
+    async def write_async(self, record: dict) -> None:
+        """Like :meth:`write`, but never blocks the event loop.
+
+        With the queue full only the calling coroutine waits, in a thread,
+        while the other tasks on the loop keep running.
+        """
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(record)
+        except queue.Full:
+            await asyncio.to_thread(self._queue.put, record)
+
+    def flush(self) -> None:
+        """Block until every queued record has been written."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.join()
 
+    def _ensure_started(self) -> None:
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(
+                    target=self._run, name="jsonl-writer", daemon=True
+                )
+                self._thread.start()
 
-def save_product(job_id: str, url: str, data: Optional[dict], status: str) -> None:
+    def _run(self) -> None:
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            while True:
+                batch = [self._queue.get()]
+                while len(batch) < self.MAX_BATCH:
+                    try:
+                        batch.append(self._queue.get_nowait())
+                    except queue.Empty:
+                        break
+                try:
+                    self._append(fd, [orjson.dumps(record) + b"\n" for record in batch])
+                except Exception as exc:  # pragma: no cover - disk errors
+                    logging.error("No se pudieron escribir %s resultados: %s", len(batch), exc)
+                finally:
+                    for _ in batch:
+                        self._queue.task_done()
+        finally:  # pragma: no cover - the thread is a daemon
+            os.close(fd)
+
+    @staticmethod
+    def _append(fd: int, lines: List[bytes]) -> None:
+        if fcntl is not None:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+        try:
+            written = os.writev(fd, lines)
+            total = sum(len(line) for line in lines)
+            if written < total:
+                # Escritura parcial (p. ej. disco casi lleno): completar el resto.
+                rest = memoryview(b"".join(lines))[written:]
+                while rest:
+                    rest = rest[os.write(fd, rest):]
+        finally:
+            if fcntl is not None:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+
+results_writer = JsonlWriter(RESULTS_FILE)
+atexit.register(results_writer.flush)
+
+
+def save_product(job_id: str, url: str, data: Optional[dict], status: str) -> List[str]:
     """Persist a single result dictionary into the SQLite database."""
-    database.save_result(job_id, url, data, status)
+    return database.save_result(job_id, url, data, status)
+
+
+def save_products(rows: List[dict]) -> List[str]:
+    """Persist a batch of result rows in a single transaction.
+
+    Rows use the same keys as :func:`save_product` arguments (``job_id``,
+    ``url``, ``data`` and ``status``). Returns the ids of the jobs that this
+    batch completed.
+    """
+    return database.save_results_bulk(rows)
+
+
+def append_result_line(data: dict) -> None:
+    """Queue ``data`` to be appended to ``results.jsonl``."""
+    results_writer.write(data)
+
+
+async def append_result_line_async(data: dict) -> None:
+    """Queue ``data`` for ``results.jsonl`` from a coroutine without blocking the loop."""
+    await results_writer.write_async(data)
@@ -1,13 +1,15 @@
-!pip install --upgrade openai==1.25.0 playwright requests beautifulsoup4 lxml \
-               openpyxl tqdm nest_asyncio pillow
+!pip install --upgrade openai==1.25.0 playwright httpx beautifulsoup4 lxml \
+               openpyxl orjson tqdm nest_asyncio pillow
 !playwright install chromium --with-deps
 
-import os, asyncio, gzip, json, logging, re, random
+import os, asyncio, gzip, hashlib, io, logging, re, random, time, zlib
 from urllib.parse import urljoin, urlparse, urldefrag
 from collections import deque
+from pathlib import Path
 
-import nest_asyncio, requests
+import httpx, nest_asyncio, orjson
 from bs4 import BeautifulSoup
+from lxml import etree, html as lxml_html
 from playwright.async_api import async_playwright, TimeoutError as PWTimeout
 from openpyxl import Workbook
 from tqdm.asyncio import tqdm_asyncio
@@ -15,13 +17,29 @@ from openai import AsyncOpenAI
 
 # ─────────────────── CONFIGURACIÓN GENERAL ───────────────────
 DOMINIOS         = ["https://www.drogueriascolsubsidio.com/","https://www.cruzverde.com.co/","https://www.locatelcolombia.com/","https://www.farmatodo.com.co/"]
+# Dominios cuyas fichas de producto llegan renderizadas desde el servidor: se
+# navegan sin JavaScript y sin la espera extra tras networkidle.
+DOMINIOS_SIN_JS  = set()
 HEADERS          = {"User-Agent": "Mozilla/5.0 (X11; Linux x86_64) Scraper/2.0"}
 REQUEST_TIMEOUT  = 100
 PAGE_TIMEOUT_MS  = 300000
+# En cuanto aparece el precio la ficha ya está renderizada: se espera a este
+# selector en lugar de a networkidle. SELECTORES lo sustituye por dominio
+# (netloc sin "www."); con None se vuelve a esperar networkidle.
+PRICE_SELECTOR   = "[itemprop='price'], [class*='product-price'], [class*='sellingPrice']"
+SELECTORES       = {}
+SELECTOR_TIMEOUT_MS = 8_000
 MAX_PAGES_CRAWL  = 60000
 MAX_FETCH_RETRY  = 5
-CONCURRENCY      = 3
+CONCURRENCY      = 3      # llamadas a GPT simultáneas
+BROWSER_PAGES    = 6      # contextos/páginas de Playwright trabajando en paralelo
 GPT_MODEL        = "gpt-4o-mini"
+GPT_BATCH_SIZE   = 8      # páginas por llamada a GPT
+GPT_BATCH_WAIT   = 2.0    # s máx. esperando a completar un lote
+GPT_QUEUE_MAX    = GPT_BATCH_SIZE * CONCURRENCY * 2   # páginas en espera de GPT antes de frenar el navegador
+JSONLD_SIN_GPT   = True   # fichas con JSON-LD Product completo no pasan por GPT
+CACHE_DIR        = Path(".html_cache")   # HTML y respuestas de GPT ya obtenidos
+HTML_CACHE_TTL   = 7 * 24 * 3600          # s; pasado este tiempo se vuelve a descargar
 
 # La API key se carga desde la variable de entorno OPENAI_API_KEY
 # No necesitamos configuración adicional de httpx para OpenAI
@@ -30,27 +48,127 @@ nest_asyncio.apply()
 # El cliente de OpenAI se inicializa en scraper/extractor.py
 
 # ─────────────────── CONTROL DE TOKENS ───────────────────
-MAX_CONTENT_TOKENS = 118_000   # 128 000 (máx modelo) –≈ 10 000 margen otros campos
+MODEL_CONTEXT_TOKENS = 128_000   # ventana de contexto del modelo
+RESPONSE_TOKENS      = 4_096     # reservados para el JSON de respuesta
+# MAX_CONTENT_TOKENS (lo que queda para el contenido) se calcula tras definir
+# el prompt, restando lo que ocupan sus partes fijas.
 
 try:
     import tiktoken
     _ENC = tiktoken.encoding_for_model(GPT_MODEL)
-except ImportError:
+except Exception:  # sin tiktoken o sin poder descargar la codificación
     _ENC = None
     logging.warning("tiktoken no disponible; el truncado será aproximado por longitud.")
 
-def _truncate(text: str, max_tokens: int = MAX_CONTENT_TOKENS) -> str:
+def _count_tokens(text: str) -> int:
+    # sin tiktoken se cuentan bytes: nunca hay más tokens que bytes
+    return len(_ENC.encode_ordinary(text)) if _ENC else len(text.encode("utf-8"))
+
+def _truncate(text: str, max_tokens: int = None) -> str:
     """Recorta el string para que no exceda el nº máximo de tokens."""
+    if max_tokens is None:
+        max_tokens = MAX_CONTENT_TOKENS
+    # cada token ocupa ≥ 1 byte: si cabe en bytes, cabe en tokens
+    if len(text) <= max_tokens and len(text.encode("utf-8")) <= max_tokens:
+        return text
     if _ENC:
-        toks = _ENC.encode(text)
+        toks = _ENC.encode_ordinary(text)
         if len(toks) > max_tokens:
             text = _ENC.decode(toks[:max_tokens])
     else:  # aproximación: 1 token ~ 4 chars
         text = text[: max_tokens * 4]
     return text
 
+# ─────────────────── CACHÉ EN DISCO ───────────────────
+def _cache_path(key: str, suffix: str) -> Path:
+    return CACHE_DIR / key[:2] / (key[2:] + suffix)
+
+def _cache_read(key: str, suffix: str, ttl=None):
+    """Bytes guardados para ``key`` o None si no existen o caducaron."""
+    path = _cache_path(key, suffix)
+    try:
+        if ttl is not None and time.time() - path.stat().st_mtime > ttl:
+            return None
+        return gzip.decompress(path.read_bytes())
+    except (OSError, EOFError):
+        return None
+
+def _cache_write(key: str, suffix: str, data: bytes) -> None:
+    path = _cache_path(key, suffix)
+    try:
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(gzip.compress(data, 1))
+    except OSError as e:
+        logging.warning("No se pudo escribir la caché %s ➜ %s", path, e)
+
+# ─────────────────── DATOS ESTRUCTURADOS (JSON-LD) ───────────────────
+_JSONLD_RX = re.compile(r'<script[^>]*application/ld\+json[^>]*>(.*?)</script>', re.I | re.S)
+# Con estos campos la ficha se da por extraída sin llamar a GPT
+_JSONLD_REQUIRED = ("title", "price", "currency", "image_url")
+_AVAILABILITY = {"InStock": "en inventario", "OutOfStock": "agotado",
+                 "SoldOut": "agotado", "LimitedAvailability": "baja existencia"}
+
+def _jsonld_nodes(obj):
+    # aplana listas y bloques @graph
+    if isinstance(obj, list):
+        for item in obj:
+            yield from _jsonld_nodes(item)
+    elif isinstance(obj, dict):
+        yield obj
+        yield from _jsonld_nodes(obj.get("@graph"))
+
+def _first(value):
+    return value[0] if isinstance(value, list) and value else value
+
+def _jsonld_product(html: str) -> dict:
+    """Campos del primer Product JSON-LD de la página con los nombres de PRODUCT_SCHEMA."""
+    for block in _JSONLD_RX.findall(html):
+        try:
+            data = orjson.loads(block.strip())
+        except orjson.JSONDecodeError:
+            continue
+        for node in _jsonld_nodes(data):
+            types = node.get("@type")
+            if "Product" not in (types if isinstance(types, list) else [types]):
+                continue
+            brand, image = _first(node.get("brand")), _first(node.get("image"))
+            if isinstance(brand, dict):
+                brand = brand.get("name")
+            if isinstance(image, dict):
+                image = image.get("url")
+            offer = _first(node.get("offers"))
+            if not isinstance(offer, dict):
+                offer = {}
+            try:
+                price = float(offer.get("price", offer.get("lowPrice")))
+            except (TypeError, ValueError):
+                price = None
+            availability = str(offer.get("availability", "")).rsplit("/", 1)[-1]
+            description = node.get("description")
+            fields = {
+                "title": node.get("name"),
+                "brand": brand,
+                "price": price,
+                "currency": offer.get("priceCurrency"),
+                "image_url": image,
+                "sku": node.get("sku"),
+                "ean": node.get("gtin13") or node.get("gtin"),
+                "short_description": " ".join(str(description).split()[:30]) if description else None,
+                "inventory": _AVAILABILITY.get(availability),
+            }
+            return {k: v for k, v in fields.items() if v not in (None, "")}
+    return {}
+
 # ─────────────────── EXTRACCIÓN RESUMIDA DE CONTENIDO ───────────────────
-def extract_text_and_urls(html: str) -> str:
+_CONTENT_TAGS = ("h1", "h2", "h3", "h4", "h5", "h6", "p", "li", "img", "a")
+# Con más de 8 caracteres por token del presupuesto, este ya está cubierto
+_CHARS_PER_TOKEN = 8
+
+def _text(elem) -> str:
+    """Texto del elemento con los fragmentos recortados y unidos por espacios."""
+    return " ".join(filter(None, map(str.strip, elem.itertext())))
+
+def extract_text_and_urls(html: str, max_tokens: int = None) -> str:
     """
     Convierte el HTML a un string compacto y jerárquico:
       • Hn: encabezados
@@ -58,36 +176,41 @@ def extract_text_and_urls(html: str) -> str:
       • IMG: url [ALT: …]
       • LINK: texto -> url
       • OG_IMAGE: url  (primera si existe)
+      • JSON_LD: campos del Product JSON-LD (si existe)
     """
-    soup = BeautifulSoup(html, "lxml")
+    try:
+        root = lxml_html.fromstring(html)
+    except ValueError:  # cadenas con declaración de codificación XML
+        root = lxml_html.fromstring(html.encode("utf-8"))
+    except etree.ParserError:  # documento vacío
+        return ""
 
     # eliminar ruido
-    for tag in soup(["script", "style", "noscript", "template", "iframe"]):
-        tag.decompose()
+    etree.strip_elements(root, "script", "style", "noscript", "template", "iframe",
+                         with_tail=False)
 
     pieces = []
 
     # Imagen principal por metadatos Open Graph / Twitter
-    meta_img = (soup.find("meta", property="og:image")
-                or soup.find("meta", attrs={"name": "twitter:image"}))
-    if meta_img and meta_img.get("content"):
-        pieces.append(f"OG_IMAGE: {meta_img['content']}")
-
-    # Recorrido en orden de aparición
-    walker = soup.body or soup
-    for elem in walker.descendants:
-        if not getattr(elem, "name", None):
-            continue
-
-        tag = elem.name.lower()
-        if tag in ("h1", "h2", "h3", "h4", "h5", "h6"):
-            txt = elem.get_text(" ", strip=True)
-            if txt:
-                pieces.append(f"{tag.upper()}: {txt}")
-        elif tag in ("p", "li"):
-            txt = elem.get_text(" ", strip=True)
-            if txt:
-                pieces.append(txt)
+    meta_img = (root.xpath("//meta[@property='og:image']/@content")
+                or root.xpath("//meta[@name='twitter:image']/@content"))
+    if meta_img and meta_img[0]:
+        pieces.append(f"OG_IMAGE: {meta_img[0]}")
+    hint = _jsonld_product(html)
+    if hint:
+        pieces.append(f"JSON_LD: {orjson.dumps(hint).decode()}")
+
+    # Recorrido en orden de aparición (solo las etiquetas que interesan)
+    walker = root.find("body")
+    if walker is None:
+        walker = root
+    if max_tokens is None:
+        max_tokens = MAX_CONTENT_TOKENS
+    size, max_chars = 0, max_tokens * _CHARS_PER_TOKEN
+    for elem in walker.iter(*_CONTENT_TAGS):
+        tag, entry = elem.tag, None
+        if tag in ("p", "li"):
+            entry = _text(elem)
         elif tag == "img":
             src = elem.get("src") or elem.get("data-src")
             if src and not _IMG_RX.search(src):
@@ -96,23 +219,47 @@ def extract_text_and_urls(html: str) -> str:
                 entry = f"IMG: {src}"
                 if alt:
                     entry += f" [ALT: {alt}]"
-                pieces.append(entry)
         elif tag == "a":
             href = elem.get("href")
-            txt = elem.get_text(" ", strip=True)
+            txt = _text(elem)
             if href and txt:
-                pieces.append(f"LINK: {txt} -> {href}")
+                entry = f"LINK: {txt} -> {href}"
+        else:  # h1…h6
+            txt = _text(elem)
+            if txt:
+                entry = f"{tag.upper()}: {txt}"
+
+        if entry:
+            pieces.append(entry)
+            size += len(entry) + 1
+            if size > max_chars:
+                break  # lo que sigue lo recortaría _truncate de todos modos
 
     content = "\n".join(pieces)
-    return _truncate(content)
+    return _truncate(content, max_tokens)
 
 # ─────────────────── FILTROS DE URL ───────────────────
+_BLOCKED_RESOURCES = frozenset({"image", "media", "font", "stylesheet"})
 _IMG_RX      = re.compile(r"\.(?:png|jpe?g|gif|webp|avif|bmp|svg)$", re.I)
-_EXCLUDE_RX  = re.compile(r"(?:cdn\.shopify|\.jpg$|\.jpeg$|\.png$|\.gif$|\.svg$|\.webp$|\.avif$|\.bmp$)", re.I)
+_BAD_SUFFIXES = (".jpg", ".jpeg", ".png", ".gif", ".svg", ".webp", ".avif", ".bmp")
+
+# Señales baratas de ficha de producto; las páginas sin ninguna no van a GPT
+# (marcado schema.org/JSON-LD u Open Graph de producto, botón de añadir al
+# carrito, un precio con separador de miles como "$ 12.900" o itemprop="price").
+_PRODUCT_HINT_RX = re.compile(
+    r'itemtype=["\']https?://schema\.org/Product["\']|"@type"\s*:\s*\[?\s*"Product"'
+    r'|og:type["\']\s+content=["\']product'
+    r'|(?:añadir|agregar) al carrito|itemprop=["\']price["\']'
+    r'|\$\s?\d{1,3}(?:[.,]\d{3})+', re.I)
+_PRODUCT_HINT_SPAN = 200_000   # caracteres del HTML en los que se busca
+
+def _looks_like_product(html: str) -> bool:
+    return _PRODUCT_HINT_RX.search(html, 0, _PRODUCT_HINT_SPAN) is not None
 
 def _url_ok(u: str) -> bool:
     """True si la URL merece ser procesada (no imagen/CDN)."""
-    return not _EXCLUDE_RX.search(u)
+    u = u.lower()
+    return not (u.endswith(_BAD_SUFFIXES) or "cdn.shopify" in u)
 
 # ─────────────────── ESQUEMA JSON_SCHEMA ───────────────────
 PRODUCT_SCHEMA = {
@@ -208,137 +355,431 @@ PRODUCT_SCHEMA = {
     }
 }
 
+# Un objeto con un producto por página del lote (cada uno con su URL)
+PRODUCT_BATCH_SCHEMA = {
+    "name": "drugstore_product_batch_schema",
+    "strict": True,
+    "schema": {
+        "type": "object",
+        "properties": {
+            "products": {
+                "type": "array",
+                "items": {
+                    **PRODUCT_SCHEMA["schema"],
+                    "properties": {"url": {"type": "string"},
+                                   **PRODUCT_SCHEMA["schema"]["properties"]},
+                    "required": ["url", *PRODUCT_SCHEMA["schema"]["required"]],
+                },
+            }
+        },
+        "required": ["products"],
+        "additionalProperties": False
+    }
+}
+
 # ─────────────────── UTILIDADES ───────────────────
 _SITEMAP_PATHS = ["/sitemap.xml","/sitemap_index.xml",
                   "/sitemap.xml.gz","/wp-sitemap.xml"]
 
-def _try_get(u, headers=None):
+HTTP_CONCURRENCY = 20   # peticiones HTTP simultáneas (sitemaps y crawling)
+MAX_CRAWL_BYTES  = 5 * 1024 * 1024   # respuestas mayores no son páginas HTML de producto
+# Peticiones por segundo a cada dominio (HTTP y navegación de Playwright)
+DEFAULT_RATE     = float(os.getenv("SCRAPER_RATE", "4"))
+DOMAIN_RATES     = {}   # netloc → req/s para los dominios que necesitan otro ritmo
+
+class RateLimiter:
+    """Token bucket: ``rate`` peticiones por segundo con ráfagas de hasta ``burst``."""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity,
+                                  self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+_limiters = {}
+
+def _limiter(url) -> RateLimiter:
+    netloc = urlparse(url).netloc
+    if netloc not in _limiters:
+        _limiters[netloc] = RateLimiter(DOMAIN_RATES.get(netloc, DEFAULT_RATE))
+    return _limiters[netloc]
+
+# Cliente compartido: conexiones persistentes entre peticiones
+http_client = httpx.AsyncClient(headers=HEADERS, timeout=REQUEST_TIMEOUT,
+                                follow_redirects=True,
+                                limits=httpx.Limits(max_connections=100))
+_http_sem = asyncio.Semaphore(HTTP_CONCURRENCY)
+
+async def _try_get(u, headers=None):
     try:
-        return requests.get(u, timeout=REQUEST_TIMEOUT, headers=headers or HEADERS)
+        await _limiter(u).acquire()
+        async with _http_sem:
+            return await http_client.get(u, headers=headers)
     except Exception:
         return None
 
-def discover_sitemaps(base_url: str):
+async def _get_html(u):
+    """HTML de ``u`` o None si falla, no es HTML o pasa de MAX_CRAWL_BYTES.
+
+    El cuerpo se lee en streaming: las respuestas grandes se descartan por su
+    Content-Length antes de descargarlas y, sin esa cabecera (chunked), en
+    cuanto superan el límite.
+    """
+    try:
+        await _limiter(u).acquire()
+        async with _http_sem:
+            async with http_client.stream("GET", u) as res:
+                if not (res.is_success and "text/html" in res.headers.get("content-type", "")):
+                    return None
+                if int(res.headers.get("content-length") or 0) > MAX_CRAWL_BYTES:
+                    return None
+                chunks, size = [], 0
+                async for chunk in res.aiter_bytes():
+                    size += len(chunk)
+                    if size > MAX_CRAWL_BYTES:
+                        return None
+                    chunks.append(chunk)
+                return b"".join(chunks).decode(res.encoding or "utf-8", "replace")
+    except Exception:
+        return None
+
+async def discover_sitemaps(base_url: str):
     parsed = urlparse(base_url if "://" in base_url else "https://"+base_url)
     base   = f"{parsed.scheme}://{parsed.netloc}"
     cands  = [urljoin(base, p) for p in _SITEMAP_PATHS]
 
-    robots = _try_get(urljoin(base, "/robots.txt"))
-    if robots and robots.ok:
+    robots, home = await asyncio.gather(_try_get(urljoin(base, "/robots.txt")),
+                                        _try_get(base))
+    if robots and robots.is_success:
         cands += [l.split(":",1)[1].strip() for l in robots.text.splitlines()
                   if l.lower().startswith("sitemap:")]
 
-    home = _try_get(base)
-    if home and home.ok:
+    if home and home.is_success:
         soup = BeautifulSoup(home.text, "lxml")
         cands += [urljoin(base, l["href"])
                   for l in soup.find_all("link",
                                          rel=lambda x: x and "sitemap" in x.lower())
                   if l.get("href")]
 
-    sitemaps, seen = [], set()
-    for u in cands:
-        if u in seen: continue
-        seen.add(u)
-        res = _try_get(u, headers={"Accept":"application/xml"})
-        if res and res.ok and res.content.startswith(b"<?xml"):
-            sitemaps.append((res.url, res.content))
+    cands = list(dict.fromkeys(cands))
+    resps = await asyncio.gather(*[_try_get(u, headers={"Accept":"application/xml"})
+                                   for u in cands])
+    sitemaps = []
+    for res in resps:
+        if res and res.is_success and res.content.startswith(b"<?xml"):
+            sitemaps.append((str(res.url), res.content))
             logging.info("✔️ Sitemap válido: %s", res.url)
     return sitemaps
 
-def urls_from_sitemaps(sitemaps):
-    """Devuelve lista única de URLs filtradas."""
-    urls = []
-    for url, xml in sitemaps:
-        try:
-            if url.endswith(".gz"):
-                xml = gzip.decompress(xml)
-            soup = BeautifulSoup(xml, "xml")
-        except Exception:
+def _parse_sitemap(xml: bytes):
+    """(es_sitemapindex, [loc…]) recorriendo el XML en streaming."""
+    is_index, locs = False, []
+    # XML remoto: sin entidades externas ni accesos a red
+    for _, el in etree.iterparse(io.BytesIO(xml), recover=True,
+                                 resolve_entities=False, no_network=True):
+        if not isinstance(el.tag, str):
             continue
-
-        if soup.find("sitemapindex"):
-            for loc in soup.find_all("loc"):
-                sub = _try_get(loc.text.strip())
-                if sub and sub.ok:
-                    urls += urls_from_sitemaps([(sub.url, sub.content)])
-        else:
-            urls += [loc.text.strip() for loc in soup.find_all("loc")]
+        name = el.tag.rsplit("}", 1)[-1]
+        if name == "loc" and el.text:
+            locs.append(el.text.strip())
+        elif name == "sitemapindex":
+            is_index = True
+        el.clear()
+    return is_index, locs
+
+async def urls_from_sitemaps(sitemaps):
+    """Devuelve lista única de URLs filtradas.
+
+    Los índices se recorren por niveles: los hijos de todos los índices de un
+    nivel se descargan a la vez y ningún sitemap se descarga dos veces.
+    """
+    urls = []
+    pending = list(dict(sitemaps).items())  # una vez por URL aunque llegue repetida
+    seen = {url for url, _ in pending}
+    while pending:
+        children = []
+        for url, xml in pending:
+            try:
+                if url.endswith(".gz") and xml[:2] == b"\x1f\x8b":
+                    xml = gzip.decompress(xml)
+                is_index, locs = _parse_sitemap(xml)
+            except Exception:
+                continue
+
+            if not is_index:
+                urls += locs
+                continue
+            for loc in locs:
+                if loc not in seen:
+                    seen.add(loc)
+                    children.append(loc)
+
+        subs = await asyncio.gather(*map(_try_get, children))
+        pending = [(str(sub.url), sub.content) for sub in subs if sub and sub.is_success]
 
     urls = [u for u in urls if _url_ok(u)]
     logging.info("🔎 URLs sitemap (filtradas): %d", len(urls))
     return list(dict.fromkeys(urls))
 
-def crawl_site(base_url, limit=MAX_PAGES_CRAWL):
+async def crawl_site(base_url, limit=MAX_PAGES_CRAWL):
     logging.warning("🌐 Sin sitemap; crawling %s", base_url)
     dom = urlparse(base_url).netloc
     q, seen, out = deque([base_url]), set(), []
+    ok = _url_ok
 
     while q and len(out) < limit:
-        url = q.popleft()
-        if url in seen or not _url_ok(url):
-            continue
-
-        seen.add(url)
-        res = _try_get(url)
-        if not (res and res.ok and "text/html" in res.headers.get("content-type","")):
-            continue
-
-        out.append(url)
-        soup = BeautifulSoup(res.text, "lxml")
-        for a in soup.find_all("a", href=True):
-            href = urldefrag(urljoin(url, a["href"]))[0]
-            if (urlparse(href).netloc == dom and
-                href not in seen and
-                _url_ok(href)):
-                q.append(href)
+        # se descarga un nivel de hasta HTTP_CONCURRENCY URLs a la vez
+        batch = []
+        while q and len(batch) < HTTP_CONCURRENCY:
+            url = q.popleft()
+            if url in seen or not ok(url):
+                continue
+            seen.add(url)
+            batch.append(url)
+
+        for url, html in zip(batch, await asyncio.gather(*map(_get_html, batch))):
+            if len(out) >= limit:
+                break
+            if html is None:
+                continue
+
+            out.append(url)
+            try:
+                hrefs = lxml_html.fromstring(html).xpath("//a/@href")
+            except ValueError:  # cadenas con declaración de codificación XML
+                hrefs = lxml_html.fromstring(html.encode("utf-8")).xpath("//a/@href")
+            except etree.ParserError:  # documento vacío
+                continue
+            for href in hrefs:
+                href = urldefrag(urljoin(url, href))[0]
+                if (href not in seen and
+                    urlparse(href).netloc == dom and
+                    ok(href)):
+                    q.append(href)
 
     logging.info("✅ Crawler encontró %d URLs (filtradas)", len(out))
     return out
 
 # ───────────── GPT Structured Output ─────────────
-def build_messages(url, html):
-    content = extract_text_and_urls(html)
+# Todo el texto fijo va al principio (esquema + mensaje de sistema) y el
+# mensaje de usuario solo lleva URL y contenido: así OpenAI puede reutilizar
+# el prefijo cacheado entre llamadas.
+PROMPT_CACHE_KEY = "drugstore-v1"
+SYSTEM_PROMPT = """Eres experto en scraping de droguerías online colombianas; responde SOLO JSON con el esquema.
+
+Recibes el contenido resumido de una página: encabezados (H1…H6), párrafos, \
+IMG: url [ALT: …], LINK: texto -> url, OG_IMAGE: url y, si existe, JSON_LD \
+con los datos estructurados que publica la propia tienda.
+
+Criterios de extracción:
+- title: nombre completo del producto tal como aparece en la ficha, sin el nombre de la tienda.
+- brand: marca comercial; si no se declara, la que encabece el título.
+- presentation: formato y cantidad ('Caja x 30 tabletas', 'Frasco 120 ml').
+- dosage_form: solo si la forma farmacéutica es una de las del esquema.
+- active_ingredients y concentration: tal como figuren en la ficha, separados por comas.
+- price: precio de venta actual como número, sin separadores de miles ni símbolo; \
+si hay precio normal y precio de oferta, usa el de oferta.
+- currency: código ISO; en estas tiendas casi siempre COP.
+- short_description: máx. 20 palabras sobre uso o beneficio, sin repetir el título.
+- category: la categoría del esquema que mejor describa el producto, no la ruta del menú.
+- ean y sku: solo si aparecen en la página; no los inventes.
+- characteristics y tags: atributos y palabras clave presentes en la ficha.
+- size_variant: tallas o variantes tipo 's,m,l'.
+- image_url: imagen principal del producto (JSON_LD, OG_IMAGE o la primera IMG del producto), \
+nunca logos, banners ni iconos.
+- inventory: 'agotado' si la página indica que no hay existencias, \
+'baja existencia' si avisa de pocas unidades, en otro caso 'en inventario'.
+- prescription_required: true solo si la página indica venta bajo fórmula médica.
+- is_full_product_page: true si la página es la ficha de un único producto; \
+false para listados, categorías, búsquedas, blogs o páginas informativas.
+
+Si un dato no aparece en la página, deja el texto vacío o usa false; \
+no completes con conocimiento externo."""
+BATCH_PROMPT = (
+    SYSTEM_PROMPT + "\n\nRecibes varias páginas separadas por '---', cada una con su URL. "
+    "Devuelve un elemento en `products` por página, en el mismo orden y con su `url`."
+)
+
+# Tokens fijos de una llamada por lotes (la mayor): prompt, esquema y el
+# envoltorio "URL: …\nCONTENT:" de cada página (con URL de hasta ~200 caracteres)
+# más un margen de seguridad.
+_PAGE_WRAPPER_TOKENS = _count_tokens(f"URL: {'x' * 200}\nCONTENT:\n```\n\n```\n---\n")
+PROMPT_TOKENS = (_count_tokens(BATCH_PROMPT)
+                 + _count_tokens(orjson.dumps(PRODUCT_BATCH_SCHEMA).decode())
+                 + GPT_BATCH_SIZE * _PAGE_WRAPPER_TOKENS
+                 + 512)
+MAX_CONTENT_TOKENS = MODEL_CONTEXT_TOKENS - RESPONSE_TOKENS - PROMPT_TOKENS
+
+def build_messages(url, content):
+    """Mensajes para una página ya resumida con ``extract_text_and_urls``."""
     return [
-        {"role": "system",
-         "content": "Eres experto en scraping; responde SOLO JSON con el esquema."},
-        {"role": "user",
-         "content": (
-             f"Extrae datos del producto en {url}. "
-             "Descripción máx. 20 palabras; tallas tipo 's,m,l'.\n\n"
-             f"CONTENT:\n```\n{content}\n```"
-         )}
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": f"URL: {url}\nCONTENT:\n```\n{content}\n```"}
     ]
 
-async def gpt_extract(url, html):
+async def gpt_extract(url, content):
     try:
         rsp = await client.chat.completions.create(
             model=GPT_MODEL,
-            messages=build_messages(url, html),
+            messages=build_messages(url, content),
             temperature=0.4,
+            extra_body={"prompt_cache_key": PROMPT_CACHE_KEY},
             response_format={"type": "json_schema",
                              "json_schema": PRODUCT_SCHEMA}
         )
-        data = json.loads(rsp.choices[0].message.content)
+        data = orjson.loads(rsp.choices[0].message.content)
         data["url"] = url
         return [data]
     except Exception as e:
         logging.error("GPT error @ %s ➜ %s", url, e)
         return []
 
+def build_batch_messages(items):
+    # el presupuesto de tokens se reparte entre las páginas del lote
+    budget = MAX_CONTENT_TOKENS // len(items)
+    blocks = [f"URL: {url}\nCONTENT:\n```\n{_truncate(content, budget)}\n```"
+              for url, content in items]
+    return [
+        {"role": "system", "content": BATCH_PROMPT},
+        {"role": "user", "content": "\n---\n".join(blocks)}
+    ]
+
+async def gpt_extract_batch(items):
+    """Extrae varias páginas [(url, contenido resumido)…] con una sola llamada a GPT."""
+    if len(items) == 1:
+        return await gpt_extract(*items[0])
+    try:
+        rsp = await client.chat.completions.create(
+            model=GPT_MODEL,
+            messages=build_batch_messages(items),
+            temperature=0.4,
+            extra_body={"prompt_cache_key": PROMPT_CACHE_KEY},
+            response_format={"type": "json_schema",
+                             "json_schema": PRODUCT_BATCH_SCHEMA}
+        )
+        products = orjson.loads(rsp.choices[0].message.content)["products"]
+    except Exception as e:
+        logging.error("GPT error @ lote de %d URLs ➜ %s", len(items), e)
+        return []
+    urls = [u for u, _ in items]
+    if len(products) == len(items):
+        # mismo orden que el lote: se fija la URL original
+        for prod, url in zip(products, urls):
+            prod["url"] = url
+    return [p for p in products if p.get("url") in urls]
+
+def _gpt_cache_key(url, content):
+    # mismo modelo, URL y contenido resumido ⇒ misma respuesta
+    return hashlib.sha256(f"{GPT_MODEL}\n{url}\n{content}".encode("utf-8")).hexdigest()
+
+def _unpack(payload: bytes) -> str:
+    return zlib.decompress(payload).decode("utf-8")
+
+async def gpt_batcher(queue, sem):
+    """Agrupa los (url, html comprimido) de la cola en lotes de GPT_BATCH_SIZE; None cierra.
+
+    El HTML viaja comprimido con zlib y solo se descomprime al empezar su
+    lote, para que las páginas en espera de GPT ocupen poca memoria; cada
+    página se resume una sola vez y ese resumen sirve tanto para la clave de
+    caché como para la llamada a GPT. Como mucho hay
+    tantos lotes en curso como permite ``sem``; mientras tanto la cola se
+    llena y frena a los workers de Playwright.
+    """
+    loop, tasks, done = asyncio.get_running_loop(), [], False
+
+    async def run(batch):
+        try:
+            # las páginas ya extraídas en otra ejecución no vuelven a GPT
+            products, pending = [], []
+            for url, payload in batch:
+                content = extract_text_and_urls(_unpack(payload))
+                key = _gpt_cache_key(url, content)
+                cached = _cache_read(key, ".json.gz")
+                if cached is None:
+                    pending.append((url, content, key))
+                else:
+                    products += orjson.loads(cached)
+            if not pending:
+                return products
+            extracted = await gpt_extract_batch([(u, c) for u, c, _ in pending])
+            for url, _, key in pending:
+                found = [p for p in extracted if p.get("url") == url]
+                if found:
+                    _cache_write(key, ".json.gz", orjson.dumps(found))
+            return products + extracted
+        finally:
+            sem.release()
+
+    while not done:
+        item = await queue.get()
+        if item is None:
+            break
+        batch, deadline = [item], loop.time() + GPT_BATCH_WAIT
+        while len(batch) < GPT_BATCH_SIZE:
+            try:
+                item = await asyncio.wait_for(queue.get(), deadline - loop.time())
+            except asyncio.TimeoutError:
+                break
+            if item is None:
+                done = True
+                break
+            batch.append(item)
+        await sem.acquire()  # se libera al terminar el lote
+        tasks.append(asyncio.create_task(run(batch)))
+
+    results = await asyncio.gather(*tasks)
+    return [p for sub in results for p in sub]
+
 # ───────────── Playwright helpers ─────────────
-async def fetch_html(page, url, retries=MAX_FETCH_RETRY):
+async def _block_heavy_resources(route):
+    # Imágenes, fuentes, vídeo y CSS no aportan texto y retrasan networkidle.
+    if route.request.resource_type in _BLOCKED_RESOURCES:
+        await route.abort()
+    else:
+        await route.continue_()
+
+async def fetch_html(page, url, retries=MAX_FETCH_RETRY, settle=True):
     if _IMG_RX.search(url):
         return ""
+    key = hashlib.sha256(url.encode("utf-8")).hexdigest()
+    cached = _cache_read(key, ".html.gz", HTML_CACHE_TTL)
+    if cached is not None:
+        return cached.decode("utf-8")
+    limiter = _limiter(url)
+    selector = SELECTORES.get(urlparse(url).netloc.removeprefix("www."), PRICE_SELECTOR)
     for i in range(retries):
         try:
+            await limiter.acquire()
             await page.goto(url, timeout=PAGE_TIMEOUT_MS, wait_until="domcontentloaded")
-            try:
-                await page.wait_for_load_state("networkidle", timeout=20_000)
-            except PWTimeout:
-                pass
-            await page.wait_for_timeout(random.randint(800, 1500))
-            return await page.content()
+            if selector:
+                try:
+                    await page.wait_for_selector(selector, state="attached",
+                                                 timeout=SELECTOR_TIMEOUT_MS)
+                except PWTimeout:
+                    pass  # sin precio visible: se toma lo que haya
+            else:
+                try:
+                    await page.wait_for_load_state("networkidle", timeout=20_000)
+                except PWTimeout:
+                    pass
+                if settle:
+                    await page.wait_for_timeout(random.randint(800, 1500))
+            html = await page.content()
+            _cache_write(key, ".html.gz", html.encode("utf-8"))
+            return html
         except PWTimeout:
             logging.warning("⏱️ Timeout %s (intento %d)", url, i + 1)
         except Exception as e:
@@ -346,64 +787,102 @@ async def fetch_html(page, url, retries=MAX_FETCH_RETRY):
         await page.wait_for_timeout(min(30_000, (2 ** i) * 1_000))
     return ""
 
-async def process_url(ctx, url, sem):
-    if not _url_ok(url):
-        return []
+# URLs ya tomadas por algún dominio en esta ejecución
+_SCRAPED_URLS = set()
+
+async def page_worker(browser, url_queue, gpt_queue, products, bar, static=False):
+    """Un contexto y una página reutilizados para todas las URLs que toma de la cola.
+
+    Las fichas con JSON-LD completo se añaden directamente a ``products``; el
+    resto de páginas candidatas va a ``gpt_queue``.
+
+    Con ``static`` la página se navega sin JavaScript (dominios renderizados
+    en servidor) y sin la pausa aleatoria posterior a networkidle.
+    """
+    ctx = await browser.new_context(
+        user_agent=HEADERS["User-Agent"],
+        viewport={"width": 1280, "height": 900},
+        java_script_enabled=not static,
+        bypass_csp=True
+    )
+    await ctx.route("**/*", _block_heavy_resources)
     page = await ctx.new_page()
-    html = await fetch_html(page, url)
-    await page.close()
-    if not html:
-        return []
-    async with sem:
-        return await gpt_extract(url, html)
+    try:
+        while not url_queue.empty():
+            url = url_queue.get_nowait()
+            if url not in _SCRAPED_URLS and _url_ok(url):
+                _SCRAPED_URLS.add(url)
+                if page.is_closed():  # la página murió: se abre otra
+                    page = await ctx.new_page()
+                html = await fetch_html(page, url, settle=not static)
+                if html and _looks_like_product(html):
+                    product = _jsonld_product(html) if JSONLD_SIN_GPT else {}
+                    if all(k in product for k in _JSONLD_REQUIRED):
+                        product.update(url=url, is_full_product_page=True)
+                        products.append(product)
+                    else:
+                        await gpt_queue.put((url, zlib.compress(html.encode("utf-8"), 1)))
+            bar.update()
+    finally:
+        await ctx.close()
 
-async def scrape_domain(domain):
-    sm = discover_sitemaps(domain)
-    urls = urls_from_sitemaps(sm) if sm else crawl_site(domain)
+async def scrape_domain(browser, domain):
+    """Descubre las URLs de ``domain`` y las procesa con sus propios contextos de ``browser``."""
+    sm = await discover_sitemaps(domain)
+    urls = await urls_from_sitemaps(sm) if sm else await crawl_site(domain)
     if not urls:
         logging.error("❌ No se encontraron URLs procesables para %s", domain)
         return []
 
     sem = asyncio.Semaphore(CONCURRENCY)
-    async with async_playwright() as pw:
-        browser = await pw.chromium.launch(
-            headless=True,
-            args=["--disable-dev-shm-usage", "--no-sandbox"]
-        )
-        ctx = await browser.new_context(
-            user_agent=HEADERS["User-Agent"],
-            viewport={"width": 1280, "height": 900}
-        )
-
-        results = await tqdm_asyncio.gather(
-            *[process_url(ctx, u, sem) for u in urls],
-            desc=urlparse(domain).netloc
-        )
-        await browser.close()
-    return [p for sub in results for p in sub]
+    gpt_queue = asyncio.Queue(maxsize=GPT_QUEUE_MAX)
+    gpt = asyncio.create_task(gpt_batcher(gpt_queue, sem))
+    url_queue = asyncio.Queue()
+    for u in urls:
+        url_queue.put_nowait(u)
+    netloc = urlparse(domain).netloc
+    static = netloc in DOMINIOS_SIN_JS
+    products = []
+    with tqdm_asyncio(total=len(urls), desc=netloc) as bar:
+        await asyncio.gather(*[page_worker(browser, url_queue, gpt_queue, products, bar, static)
+                               for _ in range(BROWSER_PAGES)])
+    await gpt_queue.put(None)
+    return products + await gpt
 
 # ───────────── Guardar Excel ─────────────
 def save_excel(products, fname="productos_extraidos.xlsx"):
     if not products:
         logging.warning("⚠️ Sin productos para guardar.")
         return
-    wb = Workbook(); ws = wb.active
+    # write_only escribe cada fila al vuelo sin mantener objetos Cell en memoria
+    wb = Workbook(write_only=True); ws = wb.create_sheet()
     keys = sorted({k for p in products for k in p})
     ws.append(keys)
-    for r, prod in enumerate(products, start=2):
-        for c, k in enumerate(keys, start=1):
+    for prod in products:
+        row = []
+        for k in keys:
             val = prod.get(k, "")
-            if isinstance(val, (list, dict, set)):
-                val = json.dumps(val, ensure_ascii=False)
-            ws.cell(r, c, val)
+            if isinstance(val, set):
+                val = list(val)
+            if isinstance(val, (list, dict)):
+                val = orjson.dumps(val).decode()
+            row.append(val)
+        ws.append(row)
     wb.save(fname)
     logging.info("✅ Excel guardado: %s", fname)
 
 # ───────────── MAIN ─────────────
 async def main():
-    productos = []
-    for dom in DOMINIOS:
-        productos += await scrape_domain(dom)
+    # Los dominios se procesan a la vez; comparten un único Chromium y cada uno
+    # abre sus propios contextos.
+    async with async_playwright() as pw:
+        browser = await pw.chromium.launch(
+            headless=True,
+            args=["--disable-dev-shm-usage", "--no-sandbox"]
+        )
+        results = await asyncio.gather(*[scrape_domain(browser, d) for d in DOMINIOS])
+        await browser.close()
+    productos = [p for sub in results for p in sub]
 
     logging.info("🛒 Productos extraídos: %d", len(productos))
     save_excel(productos)